@@ -3,11 +3,15 @@ import cProfile
 import os.path
 import src.rungame
 import src.unittests
+import src.assetmanager
 import res.make_trans
 
 
 if not os.path.isfile("res/trans/trans_000.png"):
     res.make_trans.main('res/', 'res/trans/')
+    
+if src.assetmanager.bundle_outdated("res/assets.txt", "res/assets.bundle"):
+    src.assetmanager.build_bundle("res/assets.txt", "res/assets.bundle")
 
 src.unittests.run_tests(False)
 src.rungame.run()
@@ -3,11 +3,13 @@ from pygame.locals import *
 import random
 
 import game
+import observable
 from collections import deque
 
 
-class Actor(game.GameObject):
-    """Base class for all game objects that follow orders."""
+class Actor(game.GameObject, observable.Observable):
+    """Base class for all game objects that follow orders. Subscribers are
+    notified when the actor's order, order state or load changes."""
     
     def __init__(self, gamemgr, pos):
         game.GameObject.__init__(self, gamemgr, (50,50), pos)
@@ -15,7 +17,7 @@ class Actor(game.GameObject):
         self._order = None
         self._order_queue = deque(())
         self.selectable = True
-        self.carrying = None
+        self._carrying = None
         self.idling = False
 
     def update(self):
@@ -24,6 +26,7 @@ class Actor(game.GameObject):
             try:
                 self._order = self._order_queue.popleft()
                 self.Idling = False
+                self.notify()
             except IndexError:
                 self.set_order( IdleOrder(self))
                 self.idling = True
@@ -39,6 +42,7 @@ class Actor(game.GameObject):
         self._order_queue.clear()
         self._order = order
         self.idling = False
+        self.notify()
         
     def queue_order(self, order):
         if self.idling:
@@ -58,6 +62,16 @@ class Actor(game.GameObject):
     def get_order_status(self):
         return self._order.get_description()
 
+    def _get_carrying(self):
+        return self._carrying
+        
+    def _set_carrying(self, load):
+        self._carrying = load
+        self.notify()
+        
+    carrying = property( _get_carrying, _set_carrying,
+                doc="""Resource the actor is carrying, or None""")
+
 
 class BaseOrder(object):
     def __init__(self, actor):
@@ -96,6 +110,7 @@ class StatefulSuperOrder(BaseOrder):
         self._state_name = state
         self._state_order = self._start_state(state)
         self.status = "In state "+state
+        self.actor.notify()
 
     def _start_state(self, state):
         return getattr(self, "start_"+state)()
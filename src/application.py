@@ -39,9 +39,13 @@ class Application(object):
         """Resets the screen and then tells the top activity to draw"""
         #self.screen.fill((200,150,80) )
         top = self._get_top_activity()
+        rects = None
         if top is not None:
-            top.draw()
-        pygame.display.flip()
+            rects = top.draw()
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
 
     def _get_top_activity(self):
         try:
@@ -170,6 +174,8 @@ class Activity(object):
         pass
 
     def draw(self):
+        """Draws the activity. May return a list of the screen rectangles
+        it changed, to only update those instead of flipping the screen."""
         pass
 
     def pause(self):
@@ -4,6 +4,25 @@ Provides a framework for a lazy loading asset management system.
 
 import pygame
 import os
+import mmap
+import struct
+import io
+import cStringIO
+import hashlib
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+import atlas
+
+BUNDLE_MAGIC = "CVAB"
+BUNDLE_VERSION = 1
+_BUNDLE_HEADER = struct.Struct("<4sHxxI")#magic, version, entry count
+_BUNDLE_ENTRY = struct.Struct("<32s16sIIII")#tag, type, offset, length, width, height
+
+PIXEL_CACHE_MAGIC = "CVPX"
+PIXEL_CACHE_VERSION = 1
+_PIXEL_HEADER = struct.Struct("<4sHHII")#magic, version, format, width, height
+_PIXEL_FORMATS = ("RGBA", "RGB")
 
 class AssetException(Exception):
     pass
@@ -12,18 +31,211 @@ class _Asset(object):
 
     """Simple wrapper class for containing asset handles"""
     
-    def __init__(self, path, type):
+    def __init__(self, path, type, data=None, size=None):
         self.filepath = path
         self.type = type
+        self.data = data
+        self.size = size
         self.asset = None
+        self.pending = None
+        
+    def source(self):
+        """Returns what the loader should load the asset from: its file 
+        path, or a file object reading its bytes straight out of the 
+        bundle mapping if it is in a bundle."""
+        if self.data is None:
+            return self.filepath
+        buf, offset, length = self.data
+        return cStringIO.StringIO(buffer(buf, offset, length))
+        
+def read_set(path):
+    """Reads an asset set file, returning a list of (type, tag, path) 
+    with the paths relative to the current directory."""
+    basepath = os.path.split(path)[0]
+    entries = []
+    
+    file = open(path, "r")
+    for line in file:
+        tokens = line.split()
+        if len(tokens) > 0:#skip blank lines
+            if len( tokens) != 3:
+                raise Exception( "Invalid asset line {" + line + "}")
+            entries.append( (tokens[0], tokens[1], os.path.join( basepath, tokens[2])))
+    file.close()
+    return entries
+    
+def build_bundle(set_path, bundle_path):
+    """Packs every asset listed in an asset set file into one bundle file.
+    
+    The bundle starts with an index of (tag, type, offset, length, width, 
+    height) for each asset, followed by the asset files exactly as they 
+    are on disk. Width and height are those of images, and 0 for assets
+    of other types or images that fail to load. Missing files are bundled
+    empty, so they fail to load from the bundle just as they would have 
+    from disk.
+    
+    Raises:
+        AssetException: If a tag or type is too long for the index.
+    """
+    entries = read_set(set_path)
+    offset = _BUNDLE_HEADER.size + _BUNDLE_ENTRY.size*len(entries)
+    index, blobs = [], []
+    for type, tag, path in entries:
+        if len(tag) > 32 or len(type) > 16:
+            raise AssetException( "Tag or type too long to bundle: "+tag)
+        blob = ""
+        if os.path.isfile(path):
+            f = open(path, "rb")
+            blob = f.read()
+            f.close()
+        
+        width, height = 0, 0
+        if type == "image":
+            img = ImageLoader().load(path)
+            if img is not None:
+                width, height = img.get_size()
+        index.append(_BUNDLE_ENTRY.pack(tag, type, offset, len(blob), width, height))
+        blobs.append(blob)
+        offset += len(blob)
+        
+    f = open(bundle_path, "wb")
+    f.write(_BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(entries)))
+    f.write("".join(index))
+    f.write("".join(blobs))
+    f.close()
+    
+def bundle_outdated(set_path, bundle_path):
+    """Returns True if the bundle is missing, or older than the asset set 
+    file or any of the assets it lists."""
+    if not os.path.isfile(bundle_path):
+        return True
+    built = os.path.getmtime(bundle_path)
+    paths = [set_path] + [path for type, tag, path in read_set(set_path)]
+    return any(os.path.isfile(path) and os.path.getmtime(path) > built for path in paths)
         
 class ImageLoader(object):
-    """Simple asset loader class that loads images"""
+    """Simple asset loader class that loads images
+    
+    Given a cache directory, the decoded pixels of each image are saved 
+    there in a file named for a hash of the image file. Later loads of the
+    same file map the saved pixels straight into a surface instead of 
+    decoding the image again, and an edited image hashes differently, so 
+    stale pixels are never used. Images whose format can't be rebuilt 
+    from raw pixels, such as paletted or colour keyed ones, are always 
+    decoded. The saved pixels of old versions are kept until prune is 
+    called.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._used = set()
+        
     def load(self, path):
         try:
-            return pygame.image.load(path)
-        except:
-            print path
+            if self.cache_dir is None:
+                return pygame.image.load(path)
+            return self._load_cached(path)
+        except (pygame.error, IOError):
+            return None
+            
+    def _load_cached(self, path):
+        if isinstance(path, basestring):
+            f = open(path, "rb")
+            data = f.read()
+            f.close()
+        else:
+            data = path.read()
+            path = io.BytesIO(data)
+        
+        name = hashlib.sha1(data).hexdigest()+".px"
+        self._used.add(name)
+        cache_path = os.path.join(self.cache_dir, name)
+        img = self._read_pixels(cache_path)
+        if img is None:
+            img = pygame.image.load(path)
+            self._write_pixels(cache_path, img)
+        return img
+        
+    def _pixel_format(self, img):
+        """Returns the index in _PIXEL_FORMATS of the pixel layout that 
+        rebuilds img exactly, or None if there isn't one."""
+        if img.get_colorkey() is not None:
+            return None
+        for i, fmt in enumerate(_PIXEL_FORMATS):
+            probe = pygame.image.frombuffer("\0"*len(fmt), (1,1), fmt)
+            if (img.get_bitsize(), img.get_masks(), img.get_flags() & pygame.SRCALPHA) == \
+               (probe.get_bitsize(), probe.get_masks(), probe.get_flags() & pygame.SRCALPHA):
+                return i
+        return None
+        
+    def _read_pixels(self, cache_path):
+        """Maps saved pixels into a surface, or returns None if there are 
+        none or they are unusable."""
+        try:
+            f = open(cache_path, "rb")
+        except IOError:
+            return None
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (ValueError, EnvironmentError):
+            return None
+        finally:
+            f.close()
+        
+        if len(buf) < _PIXEL_HEADER.size:
+            return None
+        magic, version, fmt, width, height = _PIXEL_HEADER.unpack_from(buf)
+        if magic != PIXEL_CACHE_MAGIC or version != PIXEL_CACHE_VERSION or fmt >= len(_PIXEL_FORMATS):
+            return None
+        fmt = _PIXEL_FORMATS[fmt]
+        if len(buf) != _PIXEL_HEADER.size + width*height*len(fmt):
+            return None
+        
+        #the surface keeps the mapping alive, and copy on write keeps edits out of the file
+        return pygame.image.frombuffer(buffer(buf, _PIXEL_HEADER.size), (width, height), fmt)
+        
+    def _write_pixels(self, cache_path, img):
+        """Saves the pixels of img to cache_path. The cache only saves 
+        time, so a write that fails, say on a full disk, is abandoned 
+        and the decoded image used as is."""
+        fmt = self._pixel_format(img)
+        if fmt is None:
+            return
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError:
+            pass#already there
+            
+        #written aside and renamed into place, so a reader never sees half a file.
+        #Tags sharing an image file may write the same pixels at once on the 
+        #loading threads, but each writes its own file and the last rename wins
+        header = _PIXEL_HEADER.pack(PIXEL_CACHE_MAGIC, PIXEL_CACHE_VERSION, fmt, img.get_width(), img.get_height())
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(".tmp", "", self.cache_dir)
+            f = os.fdopen(fd, "wb")
+            try:
+                f.write(header)
+                f.write(pygame.image.tostring(img, _PIXEL_FORMATS[fmt]))
+            finally:
+                f.close()
+            os.rename(tmp_path, cache_path)
+        except EnvironmentError:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            
+    def prune(self):
+        """Deletes every file in the cache directory other than the saved 
+        pixels of the images this loader has loaded, such as the pixels of
+        old versions of edited images. Only call it once every image in use
+        has been loaded, and none are still loading."""
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name not in self._used:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
 
 class SoundLoader(object):
     """Simple sound loader class that loads audio files"""
@@ -37,45 +249,150 @@ class AssetManager(object):
     of assets from tags read from asset set files
     """
 
-    def __init__(self):
+    def __init__(self, pixel_cache=None):
         """Initializes the asset manager with loaders for
-        images and audio files
+        images and audio files, caching decoded images in the 
+        pixel_cache directory if one is given
         """
         self._assets = {} 
         self._loaders = {}
+        self._pool = None
+        self._pending = []
+        self._bundles = []
+        self._placeholders = {}
+        self.atlas = None
+        self.placeholder = pygame.Surface((1,1), pygame.SRCALPHA, 32)
         
-        self.add_asset_loader( "image", ImageLoader())
+        self._image_loader = ImageLoader(pixel_cache)
+        self.add_asset_loader( "image", self._image_loader)
         
-    def load_set(self, path):
+    def load_set(self, path, workers=0):
         """Loads a set of asset tags from the given path
         
         Loads the asset set file at the given path. All assets
         are assumed to be in the same directory as the asset set file.
         The assets will not be completely loaded until specifically
-        requested via the AssetManager.get method.
+        requested via the AssetManager.get method, unless workers is more 
+        than 0, in which case they start loading right away on a pool of
+        that many threads. Until an asset loaded this way is ready, get 
+        returns the placeholder surface in its place.
         
         Assets are listed in the asset set file as follows:
         assettype tag path
         """
-    
-        basepath = os.path.split(path)[0]
-        
-        file = open(path, "r")
-        for line in file:
-            tokens = line.split()
-            if len(tokens) > 0:#skip blank lines
-                if len( tokens) != 3:
-                    raise Exception( "Invalid asset line {" + line + "}")
-
-                type = tokens[0]    
-                tag = tokens[1]
-                path = os.path.join( basepath, tokens[2])
-                self._assets[ tag] = _Asset( path, type)
+        for type, tag, path in read_set(path):
+            self._add_asset( tag, _Asset( path, type), workers)
+            
+    def load_bundle(self, path, workers=0):
+        """Loads the assets in a bundle made by build_bundle.
+        
+        The whole bundle is memory mapped, and each asset is loaded from
+        its bytes in the mapping, as with load_set. Images still loading 
+        in the background are stood in for by transparent placeholders 
+        of the right size. The mapping is let go of once wait has 
+        collected every asset loaded from it.
+        
+        Raises:
+            AssetException: If the file is not a bundle, or is of an 
+            unsupported version.
+        """
+        f = open(path, "rb")
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if len(buf) < _BUNDLE_HEADER.size:
+            raise AssetException( "Truncated asset bundle: "+path)
+            
+        magic, version, count = _BUNDLE_HEADER.unpack_from(buf)
+        if magic != BUNDLE_MAGIC:
+            raise AssetException( "Not an asset bundle: "+path)
+        if version != BUNDLE_VERSION:
+            raise AssetException( "Unsupported asset bundle version: "+str(version))
+        
+        self._bundles.append(buf)
+        for i in xrange(count):
+            entry = _BUNDLE_ENTRY.unpack_from(buf, _BUNDLE_HEADER.size + i*_BUNDLE_ENTRY.size)
+            tag, type, offset, length, width, height = entry
+            tag, type = tag.rstrip("\0"), type.rstrip("\0")
+            size = (width, height) if width > 0 and height > 0 else None
+            self._add_asset( tag, _Asset( path+":"+tag, type, (buf, offset, length), size), workers)
+            
+    def _add_asset(self, tag, handle, workers):
+        self._assets[ tag] = handle
+        if workers > 0 and handle.type in self._loaders:
+            if self._pool is None:
+                self._pool = ThreadPool(workers)
+            handle.pending = self._pool.apply_async(self._loaders[handle.type].load, (handle.source(),))
+            self._pending.append(handle)
+                    
+    def progress(self):
+        """Returns the fraction of the assets being loaded in the background
+        that are ready, or 1.0 if none are."""
+        if not self._pending:
+            return 1.0
+        ready = sum(1 for handle in self._pending if handle.pending is None or handle.pending.ready())
+        return float(ready) / len(self._pending)
+        
+    def wait(self):
+        """Blocks until every asset being loaded in the background is ready."""
+        for handle in self._pending:
+            self._collect(handle)
+            handle.data = None
+        del self._pending[:]
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            
+        #bundles no asset is left to load from are unmapped once their last reference goes
+        in_use = set(id(h.data[0]) for h in self._assets.itervalues() if h.data is not None)
+        self._bundles[:] = [buf for buf in self._bundles if id(buf) in in_use]
+            
+    def prune_pixel_cache(self):
+        """Waits for the background loading, then deletes the saved pixels
+        that no image loaded so far hashes to. Images not yet loaded lose 
+        theirs too, so it is meant for once every image has been loaded."""
+        self.wait()
+        self._image_loader.prune()
+            
+    def _collect(self, handle):
+        if handle.pending is not None:
+            handle.asset = handle.pending.get()
+            handle.pending = None
         
     def add_asset_loader(self, type, loader):
         """Adds a loader class for the given asset type"""
         self._loaders[type] = loader
         
+    def get_images(self):
+        """Loads every image asset and returns a dict of tag: surface.
+        Images that failed to load are left out."""
+        self.wait()
+        images = {}
+        for tag, handle in self._assets.iteritems():
+            if handle.type == "image":
+                img = self.get(tag)
+                if img is not None:
+                    images[tag] = img
+        return images
+        
+    def build_atlas(self, page_size=(2048,2048)):
+        """Loads every image asset and packs them onto atlas pages.
+        
+        From then on get returns subsurfaces of the atlas pages, so sprites
+        are blitted from a few large surfaces and a transform cache given 
+        the atlas can scale whole pages instead of single sprites. Images 
+        the atlas can't hold are kept as they were loaded.
+        
+        Returns:
+            The SpriteAtlas holding the images.
+        """
+        self.atlas = atlas.SpriteAtlas(page_size)
+        for tag, sub in self.atlas.pack(self.get_images()).iteritems():
+            self._assets[tag].asset = sub
+        return self.atlas
+        
     def _get_loader(self, type):
         pass
         
@@ -86,6 +403,9 @@ class AssetManager(object):
         will be cached, and this version will be returned rather
         than reloaded.
         
+        If the asset is still loading in the background the placeholder 
+        surface is returned instead.
+        
         Raises:
             AssetException: If no asset is found for the given tag
             or no loader is found for the asset type of the requested
@@ -97,13 +417,27 @@ class AssetManager(object):
         except KeyError:
             raise AssetException( "Unkown asset tag: "+tag)        
         
+        if handle.pending is not None:
+            if not handle.pending.ready():
+                return self._placeholder(handle.size)
+            self._collect(handle)
+        
         if handle.asset is None:
             try:
                 loader = self._loaders[handle.type]
             except KeyError:
                 raise AssetException( "Unrecognised type: " 
                     + handle.type)
-            handle.asset = loader.load( handle.filepath)
+            handle.asset = loader.load( handle.source())
         return handle.asset
         
+    def _placeholder(self, size):
+        if size is None:
+            return self.placeholder
+        try:
+            return self._placeholders[size]
+        except KeyError:
+            img = self._placeholders[size] = pygame.Surface(size, pygame.SRCALPHA, 32)
+            return img
+        
     
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""Provides a packer that gathers many small images onto a few large surfaces"""
+
+import pygame
+
+class SpriteAtlas(object):
+    """Packs images onto a few large atlas pages.
+
+    Images are placed tallest first on shelves running across each page,
+    and every image starts on a multiple of align pixels. Scaling a whole
+    page by a power of two down to 1/align then keeps each image on whole
+    pixels, so one scaled copy of a page can stand in for scaled copies of
+    every image on it.
+    """
+
+    def __init__(self, page_size=(2048,2048), align=16):
+        self.page_size = page_size
+        self.align = align
+        self.pages = []
+        self._shelves = []
+        self._regions = {}
+
+    def __contains__(self, tag):
+        return tag in self._regions
+
+    def _padded(self, n):
+        return -(-n // self.align) * self.align
+
+    def can_pack(self, surface):
+        """Returns True if the surface can be copied onto a page as it is.
+
+        Only surfaces with per pixel alpha are packed, and the pages take
+        the pixel format of the first one, so blits from the atlas blend
+        exactly as blits from the original images did. Surfaces in other
+        formats or larger than a page are left alone.
+        """
+        w, h = surface.get_size()
+        if w <= 0 or h <= 0 or w > self.page_size[0] or h > self.page_size[1]:
+            return False
+        if not surface.get_flags() & pygame.SRCALPHA or surface.get_bitsize() != 32:
+            return False
+        return not self.pages or surface.get_masks() == self.pages[0].get_masks()
+
+    def pack(self, images):
+        """Copies the given images onto the atlas pages.
+
+        Args:
+            images: dict of tag: surface
+
+        Returns:
+            A dict of tag: subsurface of an atlas page for every image that
+            could be packed.
+        """
+        packed = {}
+        order = sorted(images, key=lambda tag: (-images[tag].get_height(), tag))
+        for tag in order:
+            img = images[tag]
+            if not self.can_pack(img):
+                continue
+            page, pos = self._place(img, self._padded(img.get_width()), self._padded(img.get_height()))
+
+            #the pages start out fully transparent, so this copies the pixels with their alpha
+            self.pages[page].blit(img, pos, special_flags=pygame.BLEND_RGBA_MAX)
+            self._regions[tag] = (page, pygame.Rect(pos, img.get_size()))
+            packed[tag] = self.get(tag)
+        return packed
+
+    def _place(self, img, w, h):
+        """Finds room for a w x h block, opening a new shelf or page if
+        needed, and returns (page index, position). New pages take the 
+        pixel format of img."""
+        pw, ph = self.page_size
+        for page, shelves in enumerate(self._shelves):
+            for shelf in shelves:
+                y, height, used = shelf
+                if h <= height and used + w <= pw:
+                    shelf[2] += w
+                    return page, (used, y)
+            top = shelves[-1][0] + shelves[-1][1] if shelves else 0
+            if top + h <= ph:
+                shelves.append([top, h, w])
+                return page, (0, top)
+
+        self.pages.append(pygame.Surface(self.page_size, pygame.SRCALPHA, 32, img.get_masks()))
+        self._shelves.append([[0, h, w]])
+        return len(self.pages)-1, (0, 0)
+
+    def get(self, tag):
+        """Returns the subsurface holding the image packed under tag.
+
+        Raises:
+            KeyError: If no image was packed under tag.
+        """
+        page, rect = self._regions[tag]
+        return self.pages[page].subsurface(rect)
+
+    def memory_usage(self):
+        """Returns the number of bytes used by the atlas pages."""
+        return sum(p.get_bytesize() * p.get_width() * p.get_height() for p in self.pages)
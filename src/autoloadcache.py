@@ -1,27 +1,109 @@
 """This module provides an auto-loading cache utility class"""
 
+from collections import OrderedDict
+
 class AutoLoadCache(object):
-    """Utility class that maintains a cache, auto loading missing entries via the supplied loader"""
+    """Utility class that maintains a cache, auto loading missing entries via the supplied loader
+
+    If a byte budget is given the cache evicts its least recently used
+    entries to stay within it, sizing entries with the supplied sizer. The
+    newest entry is always kept, even if it alone is over the budget.
+
+    Hits, misses and evictions are counted overall and per category, where
+    the category of a key comes from the supplied classifier.
+    """
 
-    def __init__(self, loader):
-        """Initializes with the supplied loader"""
-        self._cache = {}
+    def __init__(self, loader, budget=None, sizer=None, classifier=None):
+        """Initializes with the supplied loader
+
+        Args:
+            loader: object with a _cache_load(key) method returning the entry
+            budget: maximum total size of the entries, or None for no limit
+            sizer: function returning the size of an entry, in bytes
+            classifier: function returning the statistics category of a key
+        """
+        self._cache = OrderedDict()
+        self._sizes = {}
         self._loader = loader
-        
+        self.budget = budget
+        self._sizer = sizer if sizer is not None else (lambda value: 0)
+        self._classifier = classifier if classifier is not None else (lambda key: None)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats = {}
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def _category_stats(self, key):
+        category = self._classifier(key)
+        try:
+            return self._stats[category]
+        except KeyError:
+            stats = self._stats[category] = {'hits': 0, 'misses': 0, 'evictions': 0, 'entries': 0, 'bytes': 0}
+            return stats
+
     def get(self, key):
-        """Returns the entry associated with the given key, 
+        """Returns the entry associated with the given key,
         loading it if it's not already present
         """
         try:
-            return self._cache[key]
+            value = self._cache.pop(key)
         except KeyError:
-            self.set( key, self._loader._cache_load(key))
-            return self._cache[key]
+            self.misses += 1
+            self._category_stats(key)['misses'] += 1
+            value = self._loader._cache_load(key)
+            self.set( key, value)
+            return value
+
+        #move to the most recently used end
+        self._cache[key] = value
+        self.hits += 1
+        self._category_stats(key)['hits'] += 1
+        return value
 
     def set(self, key, value):
         """Sets the cache entry for the given key with the given value"""
+        if key in self._cache:
+            self.remove(key)
+        size = self._sizer(value)
         self._cache[key] = value
-        
+        self._sizes[key] = size
+        self.size += size
+        stats = self._category_stats(key)
+        stats['entries'] += 1
+        stats['bytes'] += size
+
+        if self.budget is not None:
+            while self.size > self.budget and len(self._cache) > 1:
+                oldest = next(iter(self._cache))
+                self.remove(oldest)
+                self.evictions += 1
+                self._category_stats(oldest)['evictions'] += 1
+
     def remove(self, key):
         """Removes the key from the cache"""
-        del( self._cache[key])
\ No newline at end of file
+        del( self._cache[key])
+        size = self._sizes.pop(key)
+        self.size -= size
+        stats = self._category_stats(key)
+        stats['entries'] -= 1
+        stats['bytes'] -= size
+
+    def clear(self):
+        """Removes every entry, keeping the statistics"""
+        for key in self._cache.keys():
+            self.remove(key)
+
+    def stats(self):
+        """Returns a dict of the overall hits, misses, evictions, entry count
+        and size in bytes, with the same figures per category under
+        'categories'."""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._cache), 'bytes': self.size,
+                'categories': dict((c, dict(s)) for c, s in self._stats.iteritems())}
@@ -0,0 +1,207 @@
+"""Provides a tile map that streams fixed size chunks in and out on demand"""
+
+import os
+import random
+import shutil
+import tempfile
+
+import numpy
+
+import path
+import tilemap
+
+class _Chunk(object):
+    """Simple container for the resident data of one chunk"""
+
+    def __init__(self, terrain, tiles):
+        self.terrain = terrain
+        self.tiles = tiles
+        self.modified = False
+        self.last_used = 0
+
+
+class ChunkedMap(tilemap.BaseMap):
+    """Tile map that generates its chunks from a seed when first touched.
+
+    Nothing is allocated up front. Chunks are generated the first time the
+    viewport, pathfinding or placement asks about a cell in them, and once
+    more than max_resident chunks are loaded the least recently used ones
+    are evicted. Unmodified chunks are simply dropped, as they can be
+    regenerated from the seed, while edited ones are swapped out to disk.
+    Memory and startup cost therefore follow the explored area rather than
+    the nominal world size.
+
+    The game itself still runs on a whole tilemap.Map, as the occupancy, 
+    placement and distance layers and the map widget's chunk cache all 
+    work on whole map arrays.
+    """
+
+    def __init__(self, dims, seed=None, chunk_size=32, tilesize=(200,200), max_resident=64, swap_dir=None):
+        """Initializes the map.
+
+        Args:
+            dims: Nominal size of the world in tiles
+            seed: Seed for terrain generation, a random one is picked if None
+            chunk_size: Width and height of a chunk in tiles
+            max_resident: Number of chunks kept in memory before evicting
+            swap_dir: Directory for evicted chunks with edits, a temporary
+                directory is created when first needed if None
+        """
+        assert(len(dims) == 2)
+        tilemap.BaseMap.__init__(self, dims, tilesize)
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.chunk_size = chunk_size
+        self.max_resident = max_resident
+
+        self._chunks = {}
+        self._swapped = set()
+        self._swap_dir = swap_dir
+        self._owns_swap_dir = False
+        self._clock = 0
+
+    def close(self):
+        """Discards all chunks and removes the swap directory if we made it."""
+        self._chunks.clear()
+        self._swapped.clear()
+        if self._owns_swap_dir:
+            shutil.rmtree(self._swap_dir, True)
+            self._swap_dir = None
+            self._owns_swap_dir = False
+
+    def resident_chunks(self):
+        """Returns the keys of all chunks currently held in memory."""
+        return self._chunks.keys()
+
+    def get_chunk(self, key):
+        """Returns the chunk with the given (x,y) key, reading it back from
+        disk or generating it if it is not resident."""
+        self._clock += 1
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            if key in self._swapped:
+                chunk = self._read_chunk(key)
+            else:
+                chunk = _Chunk(*tilemap.generate_chunk(self.seed, key, self.chunk_size, self.size))
+            chunk.last_used = self._clock
+            self._chunks[key] = chunk
+            self._evict()
+        chunk.last_used = self._clock
+        return chunk
+
+    def touch_region(self, topleft, botright):
+        """Makes sure every chunk overlapping the given map rectangle
+        (inclusive, clipped to the map) is resident."""
+        c1, c2 = self._chunk_range(topleft, botright)
+        for cx in xrange(c1[0], c2[0]):
+            for cy in xrange(c1[1], c2[1]):
+                self.get_chunk((cx,cy))
+
+    def _chunk_range(self, topleft, botright):
+        cs = self.chunk_size
+        x1, y1 = max(topleft[0], 0), max(topleft[1], 0)
+        x2, y2 = min(botright[0]+1, self.size[0]), min(botright[1]+1, self.size[1])
+        return (x1 // cs, y1 // cs), ((x2+cs-1) // cs, (y2+cs-1) // cs)
+
+    def _evict(self):
+        while len(self._chunks) > self.max_resident:
+            key = min(self._chunks, key=lambda k: self._chunks[k].last_used)
+            chunk = self._chunks.pop(key)
+            if chunk.modified:
+                self._write_chunk(key, chunk)
+                self._swapped.add(key)
+
+    def _swap_path(self, key):
+        if self._swap_dir is None:
+            self._swap_dir = tempfile.mkdtemp(prefix="civilis-chunks-")
+            self._owns_swap_dir = True
+        return os.path.join(self._swap_dir, "chunk_%d_%d.bin" % key)
+
+    def _write_chunk(self, key, chunk):
+        with open(self._swap_path(key), "wb") as f:
+            f.write(chunk.terrain.tobytes() + chunk.tiles.tobytes())
+
+    def _read_chunk(self, key):
+        shape = tilemap.chunk_shape(key, self.chunk_size, self.size)
+        data = numpy.fromfile(self._swap_path(key), numpy.uint8)
+        count = shape[0]*shape[1]
+        return _Chunk(data[:count].reshape(shape), data[count:].reshape(shape))
+
+    def _locate(self, pos):
+        if pos[0] < 0 or pos[1] < 0 or pos[0] >= self.size[0] or pos[1] >= self.size[1]:
+            raise IndexError("Index out of bounds: "+str(pos))
+        cs = self.chunk_size
+        return self.get_chunk((pos[0] // cs, pos[1] // cs)), pos[0] % cs, pos[1] % cs
+
+    def get_terrain_at(self, pos):
+        chunk, x, y = self._locate(pos)
+        return chunk.terrain[x][y]
+
+    def set_terrain_at(self, pos, value):
+        chunk, x, y = self._locate(pos)
+        chunk.terrain[x][y] = value
+        chunk.modified = True
+
+        #refresh the transitions of the cell and its neighbours, which may live in other chunks
+        x1, y1 = max(pos[0]-1, 0), max(pos[1]-1, 0)
+        x2, y2 = min(pos[0]+2, self.size[0]), min(pos[1]+2, self.size[1])
+        for u in xrange(x1, x2):
+            for v in xrange(y1, y2):
+                self.set_tile_at((u,v), self.compute_tile((u,v)))
+        self._publish(x1, y1, x2, y2)
+
+    def get_tile_at(self, pos):
+        chunk, x, y = self._locate(pos)
+        return chunk.tiles[x][y]
+
+    def set_tile_at(self, pos, value):
+        chunk, x, y = self._locate(pos)
+        chunk.tiles[x][y] = value
+        chunk.modified = True
+
+    def get_terrain_region(self, topleft, botright):
+        """Assembles the terrain between the given corners (inclusive) into
+        a single array, generating any chunks it covers.
+
+        Raises:
+            IndexError: If the region is not entirely on the map.
+        """
+        x1, y1 = topleft
+        x2, y2 = botright[0]+1, botright[1]+1
+        if x1 < 0 or y1 < 0 or x2 > self.size[0] or y2 > self.size[1]:
+            raise IndexError("Region out of bounds: "+str((topleft, botright)))
+
+        cs = self.chunk_size
+        region = numpy.zeros((x2-x1, y2-y1), numpy.uint8)
+        c1, c2 = self._chunk_range(topleft, botright)
+        for cx in xrange(c1[0], c2[0]):
+            for cy in xrange(c1[1], c2[1]):
+                chunk = self.get_chunk((cx,cy))
+                u1, v1 = max(x1, cx*cs), max(y1, cy*cs)
+                u2, v2 = min(x2, cx*cs+cs), min(y2, cy*cs+cs)
+                region[u1-x1:u2-x1, v1-y1:v2-y1] = chunk.terrain[u1-cx*cs:u2-cx*cs, v1-cy*cs:v2-cy*cs]
+        return region
+
+    def map_area_clear(self, topleft, botright):
+        try:
+            return not (self.get_terrain_region(topleft, botright) == 0).any()
+        except IndexError:
+            return False
+
+    def find_map_path(self, start, finish, margin=16):
+        """Finds a path within the bounding box of start and finish grown by
+        margin tiles, so only the chunks along the way are streamed in. 
+        Paths needing a longer detour are looked for again with the margin
+        doubled, up to the whole map, before giving up."""
+        while True:
+            x1, y1 = max(min(start[0], finish[0])-margin, 0), max(min(start[1], finish[1])-margin, 0)
+            x2 = min(max(start[0], finish[0])+margin, self.size[0]-1)
+            y2 = min(max(start[1], finish[1])+margin, self.size[1]-1)
+
+            pmap = tilemap.PathableMap(self.get_terrain_region((x1,y1), (x2,y2)))
+            pather = path.PathFinder((start[0]-x1, start[1]-y1), (finish[0]-x1, finish[1]-y1), pmap)
+            the_path = pather.find_path(True)
+            if the_path is not None:
+                return [(p[0]+x1, p[1]+y1) for p in the_path]
+            if (x1, y1, x2, y2) == (0, 0, self.size[0]-1, self.size[1]-1):
+                return None
+            margin = max(margin*2, 1)
@@ -0,0 +1,124 @@
+"""Provides distance transforms over tile maps"""
+
+import numpy
+
+#pseudo terrain type matching every cell that is not water
+LAND = 'land'
+
+#incremental updates fall back to a rebuild past this many new feature cells
+_MAX_INCREMENTAL = 32
+
+def _relax(dist, near_x, near_y, cur, prev):
+    """Lets the cells of line cur take over the nearest features of the
+    adjacent line prev wherever that is shorter."""
+    better = dist[prev] + 1 < dist[cur]
+    dist[cur][better] = dist[prev][better] + 1
+    near_x[cur][better] = near_x[prev][better]
+    near_y[cur][better] = near_y[prev][better]
+
+def manhattan_transform(features):
+    """Computes the Manhattan (4-connected) distance from every cell to the
+    nearest feature cell, along with the coordinates of that feature.
+
+    Runs in linear time: one forward and one backward recurrence along each
+    axis, each vectorized across the other axis.
+
+    Args:
+        features: 2d boolean array flagging the feature cells
+
+    Returns:
+        A (distance, nearest_x, nearest_y) tuple of int32 arrays. Cells with
+        no feature on the map at all get a distance larger than the map's
+        width plus height and nearest coordinates of -1.
+    """
+    w, h = features.shape
+    far = w + h + 1
+    dist = numpy.where(features, 0, far).astype(numpy.int32)
+    near_x = numpy.where(features, numpy.arange(w)[:,None], -1).astype(numpy.int32)
+    near_y = numpy.where(features, numpy.arange(h)[None,:], -1).astype(numpy.int32)
+
+    #nearest feature within each column, then within each row of those results
+    column = lambda y: (slice(None), y)
+    for y in xrange(1, h):
+        _relax(dist, near_x, near_y, column(y), column(y-1))
+    for y in xrange(h-2, -1, -1):
+        _relax(dist, near_x, near_y, column(y), column(y+1))
+    for x in xrange(1, w):
+        _relax(dist, near_x, near_y, x, x-1)
+    for x in xrange(w-2, -1, -1):
+        _relax(dist, near_x, near_y, x, x+1)
+
+    return dist, near_x, near_y
+
+
+class TerrainDistanceField(object):
+    """Precomputed distances from every cell of a map to the nearest cell
+    of a given terrain type.
+
+    Fields are built per terrain type the first time one is queried, after
+    which distance and nearest cell lookups are single array reads. Call
+    terrain_changed after editing the map. Cells that become the terrain
+    type are folded in directly, since a new feature can only shorten
+    distances. Losing a cell of the type causes that field to be rebuilt.
+    """
+
+    def __init__(self, terrain_map):
+        self.map = terrain_map
+        self._fields = {}
+
+    def _mask(self, terrain_type, x1=0, y1=0, x2=None, y2=None):
+        terrain = self.map.terrain[x1:x2, y1:y2]
+        if terrain_type == LAND:
+            return terrain != 0
+        return terrain == terrain_type
+
+    def _field(self, terrain_type):
+        field = self._fields.get(terrain_type)
+        if field is None:
+            mask = self._mask(terrain_type)
+            field = self._fields[terrain_type] = (mask,) + manhattan_transform(mask)
+        return field
+
+    def distance(self, pos, terrain_type):
+        """Returns the Manhattan distance from the given cell to the nearest
+        cell of the terrain type, or None if there is none on the map."""
+        mask, dist, near_x, near_y = self._field(terrain_type)
+        if near_x[pos[0]][pos[1]] < 0:
+            return None
+        return int(dist[pos[0]][pos[1]])
+
+    def nearest(self, pos, terrain_type):
+        """Returns the nearest cell of the terrain type to the given cell, or
+        None if there is none on the map."""
+        mask, dist, near_x, near_y = self._field(terrain_type)
+        x = near_x[pos[0]][pos[1]]
+        if x < 0:
+            return None
+        return (int(x), int(near_y[pos[0]][pos[1]]))
+
+    def get_distances(self, terrain_type):
+        """Returns the full distance array for the terrain type."""
+        return self._field(terrain_type)[1]
+
+    def terrain_changed(self, x1, y1, x2, y2):
+        """Brings the built fields up to date after the terrain in
+        [x1,x2) x [y1,y2) changed."""
+        for terrain_type in self._fields.keys():
+            mask, dist, near_x, near_y = self._fields[terrain_type]
+            old = mask[x1:x2, y1:y2]
+            new = self._mask(terrain_type, x1, y1, x2, y2)
+            added = numpy.nonzero(new & ~old)
+
+            if (old & ~new).any() or len(added[0]) > _MAX_INCREMENTAL:
+                del self._fields[terrain_type]
+                continue
+
+            old[...] = new
+            xs = numpy.arange(dist.shape[0])[:,None]
+            ys = numpy.arange(dist.shape[1])[None,:]
+            for ax, ay in zip(added[0]+x1, added[1]+y1):
+                cone = numpy.abs(xs-ax) + numpy.abs(ys-ay)
+                better = cone < dist
+                dist[better] = cone[better]
+                near_x[better] = ax
+                near_y[better] = ay
@@ -5,6 +5,7 @@ from collections import deque
 import vector
 import reservation
 import resource
+import observable
 
 LEFTCLICK = 1
 RIGHTCLICK = 2
@@ -16,6 +17,57 @@ class Game(object):
         self._next_id = 0
         self._objects = []
         self.selected_obj = None
+        self._map = None
+        self.stores = observable.Observable()
+        self.structure_version = 0
+        
+    def _get_map(self):
+        return self._map
+        
+    def _set_map(self, new_map):
+        if self._map is not None:
+            for obj in self._objects:
+                if self._occupies(obj):
+                    self._map.remove_occupant(obj.rect)
+        self._map = new_map
+        self._stamp_structures()
+        
+    map = property(_get_map, _set_map,
+                doc="""Tile map of the game world. Structures are kept stamped 
+                onto its occupancy layer while they exist.""")
+                
+    def _stamp_structures(self):
+        for obj in self._objects:
+            if self._occupies(obj):
+                self._map.add_occupant(obj.rect)
+                
+    def load_map(self, filepath):
+        """Loads a binary map file into the current map, stamping the 
+        structures back onto its occupancy layer, which loading clears."""
+        self._map.load_binary(filepath)
+        self._stamp_structures()
+                
+    def _has_store(self, obj):
+        return getattr(obj, 'res_storage', None) is not None
+        
+    def _store_changed(self, store):
+        """Relays changes to any structure's store to subscribers of stores, 
+        for totals taken across every store in the game."""
+        self.stores.notify()
+        
+    def _structures_changed(self, obj):
+        """Bumps structure_version when a structure or store comes or goes, 
+        so anything derived from them knows to rebuild."""
+        if self._occupies(obj) or self._has_store(obj):
+            self.structure_version += 1
+        
+    def reservoirs(self):
+        """Returns the structures holding resource reservoirs."""
+        return [o for o in self._objects if isinstance(o, StructureObject) and o.res_storage is not None
+                and o.res_storage.mode == resource.ResourceStore.RESERVOIR]
+        
+    def _occupies(self, obj):
+        return isinstance(obj, StructureObject) and obj.rect.w > 0 and obj.rect.h > 0
             
     def update(self):
         for o in self._objects:
@@ -32,14 +84,32 @@ class Game(object):
             if not self._objects[j].finished:
                 self._objects[i] = self._objects[j]
                 i+=1        
+            else:
+                if self._map is not None and self._occupies(self._objects[j]):
+                    self._map.remove_occupant(self._objects[j].rect)
+                if self._has_store(self._objects[j]):
+                    self.stores.notify()
+                self._structures_changed(self._objects[j])
+                self._objects[j].moves.notify()
             j += 1        
         del self._objects[i:]
             
     def add_game_object(self, obj):
         self._objects.append(obj)
+        if self._map is not None and self._occupies(obj):
+            self._map.add_occupant(obj.rect)
+        if self._has_store(obj):
+            self.stores.notify()
+        self._structures_changed(obj)
         
     def remove_game_object(self, obj):
         self._objects.remove(obj)
+        if self._map is not None and self._occupies(obj):
+            self._map.remove_occupant(obj.rect)
+        if self._has_store(obj):
+            self.stores.notify()
+        self._structures_changed(obj)
+        obj.moves.notify()
         
     def new_object_id(self):
         self._next_id += 1
@@ -119,7 +189,10 @@ class Game(object):
 
             
 class GameObject(object):
-    """Base class for all objects that exist within the game simulation."""
+    """Base class for all objects that exist within the game simulation.
+    
+    Subscribers to moves are notified whenever the object changes position
+    or is removed from the game."""
 
     def __init__(self, gamemgr, size=(100,100), position=(0,0), mass=10.0):
         """Initialize with the given game."""
@@ -136,9 +209,11 @@ class GameObject(object):
         self.abilities = set([])
         self.move_speed = 1.0
         self.mass = mass
+        self.moves = observable.Observable()
 
     def _set_pos(self, pos):
         self.rect.center = self._position = vector.Vec2d(pos)
+        self.moves.notify()
         
     def _get_pos(self):
         return self._position
@@ -278,6 +353,9 @@ class StructureObject(GameObject):
     def set_storage(self, store):
         assert self.res_storage is None
         self.res_storage = store    
+        store.subscribe(self.game._store_changed)
+        self.game._store_changed(store)
+        self.game._structures_changed(self)
             
     def set_warehouse(self, cap, accepts):
         assert self.res_storage is None
@@ -4,12 +4,16 @@ import pygame
 from pygame.locals import *
 import math
 import sets
+import bisect
+from collections import OrderedDict
 
 #local imports
 import vector
 import viewport as viewport_mod #avoiding conflicts with variable names
 import game
 import actor
+import spatial
+import textcache
 
 #layers
 LAYER_BASE          = 0
@@ -28,8 +32,92 @@ EVENT_PRESERVE_CONTEXT  = 2
 
 tester = sets.Set()
 
+def merge_rects(rects):
+    """Merges overlapping rectangles into their unions, so no area is 
+    covered twice. Returns a new list."""
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        i = 0
+        while i < len(merged):
+            if merged[i].colliderect(rect):
+                rect.union_ip(merged.pop(i))
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+    return merged
+
+
+class LayeredOrder(object):
+    """Keeps widgets in drawing order: by layer, then by the bottom of their
+    space rects so lower widgets are drawn over higher ones.
+    
+    Each layer has its own sorted bucket. Refreshing a widget that has not 
+    moved costs one comparison, and a widget that has moved is taken out of 
+    its bucket and inserted again, so keeping the order costs in proportion 
+    to how many widgets moved. Widgets with equal keys are kept in the order 
+    they were last placed.
+    """
+    
+    def __init__(self):
+        self._layers = []
+        self._buckets = {}
+        self._entries = {}
+        self._count = 0
+        
+    def __len__(self):
+        return len(self._entries)
+        
+    def __contains__(self, widget):
+        return widget in self._entries
+        
+    def __iter__(self):
+        for layer in self._layers:
+            for entry in self._buckets[layer]:
+                yield entry[2]
+        
+    def refresh(self, widget):
+        """Adds the widget, or moves it if its position changed."""
+        bottom = widget._space_rect.bottom
+        entry = self._entries.get(widget)
+        if entry is not None:
+            if entry[0] == bottom:
+                return
+            self.remove(widget)
+            
+        bucket = self._buckets.get(widget.layer)
+        if bucket is None:
+            bucket = self._buckets[widget.layer] = []
+            bisect.insort(self._layers, widget.layer)
+        self._count += 1
+        entry = self._entries[widget] = (bottom, self._count, widget)
+        bucket.insert(bisect.bisect(bucket, entry[:2]), entry)
+        
+    def remove(self, widget):
+        """Removes the widget.
+        
+        Raises:
+            KeyError: If the widget is not in the order.
+        """
+        entry = self._entries.pop(widget)
+        bucket = self._buckets[widget.layer]
+        del bucket[bisect.bisect_left(bucket, entry[:2])]
+        
+    def discard(self, widget):
+        """Removes the widget if it is in the order."""
+        if widget in self._entries:
+            self.remove(widget)
+
+
 class InterfaceManager( object):
     """Class that manages and controls a generic interface system."""
+    
+    #share of the screen past which draw_dirty just redraws everything
+    full_redraw_ratio = 0.5
+    
+    #screen pixels beyond the edges within which world widgets stay live
+    cull_margin = 32
 
     def __init__(self, controller):
         """"Initialize the InterfaceManager"""
@@ -40,7 +128,17 @@ class InterfaceManager( object):
         self._context_menu = None
         self._selection_menu = None
         self._motion_listeners = []
-        
+        self._drawn_states = None
+        self._world_index = spatial.SpatialGrid()
+        self._world_moved = set()
+        self._added = {}
+        self._added_count = 0
+        self._overlays = []
+        self._visible = []
+        self._order = LayeredOrder()
+        self._mouseovers = []
+        
+        self.text_cache = textcache.TextCache()
         self.fonts = {
             "smallfont": pygame.font.Font(None, 16),
             "medfont": pygame.font.Font(None, 22),
@@ -51,21 +149,83 @@ class InterfaceManager( object):
         """Updates all child objects with the current mouse position etc..."""
         
         if len(self._new_children) > 0:
+            for c in self._new_children:
+                self._added_count += 1
+                self._added[c] = self._added_count
+                if c._in_world():
+                    self._world_index.insert(c, c._world_bounds())
+                else:
+                    self._overlays.append(c)
             self._children.extend(self._new_children)
             self._new_children[:] = []
         
-        #remove "finished" objects
-        self._children[:] = [child for child in self._children if not child.finished]
+        #reindex only the world widgets whose objects moved or left the game
+        moved, self._world_moved = self._world_moved, set()
+        for c in moved:
+            if c in self._world_index:
+                if c._game_object.finished:
+                    c.finished = True
+                else:
+                    self._world_index.insert(c, c._world_bounds())
+        
+        #remove "finished" objects, which were either on screen or just reported by their objects
+        finished = [c for c in self._visible if c.finished]
+        finished.extend(c for c in moved if c.finished and c not in self._visible)
+        if finished:
+            self._remove_children(finished)
         
         if self._context_menu is not None:
             if self._context_menu.finished:
                 self.cancel_context_menu()
                 
-        for c in self._children:
-            c.update( viewport, pygame.mouse.get_pos())
+        #only update world widgets near the screen, the rest keep their last state
+        on_screen = self._world_index.query(self._visible_world_rect(viewport))
+        for c in self._visible:
+            if c not in on_screen and c in self._world_index:
+                c._mouseover = False
+                self._order.discard(c)
+                
+        #culled widgets are only moved to their objects once they come back into view
+        for c in on_screen:
+            if c not in self._order:
+                c._follow_object()
+        #in the order they were added, so widgets that tie in the drawing order always stack the same way
+        visible = sorted(on_screen, key=self._added.__getitem__)
+        visible.extend(self._overlays)
+        
+        #only world widgets whose bounds are under the cursor get hit tested,
+        #the rest are updated with no mouse position
+        mousepos = pygame.mouse.get_pos()
+        under_mouse = self._world_index.query(self._world_point_rect(viewport, mousepos))
+        self._mouseovers = []
+        for c in visible:
+            if c in under_mouse or c not in self._world_index:
+                c.update( viewport, mousepos)
+                if c._mouseover:
+                    self._mouseovers.append(c)
+            else:
+                c.update( viewport, None)
+
+        #reposition the widgets that moved in the drawing order
+        for c in visible:
+            self._order.refresh(c)
+        self._visible = list(self._order)
+        
+    def _visible_world_rect(self, viewport):
+        """Returns the world rectangle shown on screen, grown by cull_margin."""
+        w, h = viewport.surface.get_size()
+        m = self.cull_margin
+        topleft = viewport.translate_point((-m, -m), viewport_mod.SCREEN_TO_GAME)
+        botright = viewport.translate_point((w+m, h+m), viewport_mod.SCREEN_TO_GAME)
+        return pygame.Rect(int(topleft[0]), int(topleft[1]), 
+                           int(botright[0]-topleft[0])+1, int(botright[1]-topleft[1])+1)
             
-        #resort objects by layer/position
-        self._children.sort( key=lambda obj: obj.layer *100000 + obj._disp_rect.bottom )
+    def _world_point_rect(self, viewport, pos):
+        """Returns a small world rectangle around the given screen point, 
+        allowing for rounding in the display rects of world widgets."""
+        x, y = viewport.translate_point(pos, viewport_mod.SCREEN_TO_GAME)
+        r = int(2/viewport.scale) + 1
+        return pygame.Rect(int(x)-r, int(y)-r, 2*r+1, 2*r+1)
             
     def set_context_menu(self, cmenu):
         """Cancels current context menu and sets a new one."""
@@ -83,7 +243,7 @@ class InterfaceManager( object):
             
     def set_selection_menu(self, smenu):
         if self._selection_menu is not None:
-            self._children.remove( self._selection_menu)
+            self.remove_child( self._selection_menu)
             self._selection_menu = None
         
         if smenu is not None:
@@ -94,21 +254,75 @@ class InterfaceManager( object):
         self._new_children.append(widget)
         
     def remove_child(self, widget):
-        self._children.remove(widget)
+        self._remove_children([widget])
+        
+    def _remove_children(self, widgets):
+        gone = set(widgets)
+        self._children[:] = [c for c in self._children if c not in gone]
+        self._overlays[:] = [c for c in self._overlays if c not in gone]
+        self._visible[:] = [c for c in self._visible if c not in gone]
+        self._mouseovers[:] = [c for c in self._mouseovers if c not in gone]
+        for widget in gone:
+            self._world_index.discard(widget)
+            self._order.discard(widget)
+            self._added.pop(widget, None)
         
     def draw(self, viewport):
-        """Draws all child objects."""
-        for c in self._children:
+        """Draws all child objects on screen."""
+        for c in self._visible:
             c.draw( viewport)
+            
+    def draw_dirty(self, viewport, extra_rects=()):
+        """Redraws only the parts of the screen that changed since the last
+        call, and returns the list of screen rectangles redrawn.
+        
+        Every widget reports its screen bounds and a key describing how it
+        looks. Widgets that appeared, disappeared, moved or changed their 
+        key are redrawn at both their old and new bounds, along with any 
+        damage they report themselves and the given extra_rects. Each dirty
+        rectangle is repainted by drawing the widgets touching it with the 
+        surface clipped to it. If too much of the screen changed, or this is 
+        the first call, everything is drawn instead.
+        """
+        surface = viewport.surface
+        screen = surface.get_rect()
+        states = {}
+        dirty = list(extra_rects)
+        subtrees = []
+        for c in self._visible:
+            subtrees.append(c._collect_draw_states(viewport, states, dirty))
+            
+        previous = self._drawn_states
+        self._drawn_states = states
+        if previous is None:
+            rects = [screen]
+        else:
+            for widget, state in states.iteritems():
+                old = previous.pop(widget, None)
+                if old != state:
+                    dirty.append(state[0])
+                    if old is not None:
+                        dirty.append(old[0])
+            for old in previous.itervalues():
+                dirty.append(old[0])
+            
+            rects = merge_rects(screen.clip(r) for r in dirty)
+            rects = [r for r in rects if r.w > 0 and r.h > 0]
+            if sum(r.w*r.h for r in rects) > self.full_redraw_ratio*screen.w*screen.h:
+                rects = [screen]
+        
+        for rect in rects:
+            surface.set_clip(rect)
+            for c, bounds in zip(self._visible, subtrees):
+                if bounds.colliderect(rect):
+                    c.draw(viewport)
+        surface.set_clip(None)
+        return rects
         
     def _find_mouseovers(self):
         """Returns a list of elements under the mouse object,
         sorted by layer (higher layers occur first in list."""
-        mouseovers = []
-        for c in self._children:
-            if c._mouseover:
-                mouseovers.append( c)
-
+        mouseovers = [c for c in self._mouseovers if c._mouseover and not c.finished]
         return sorted(mouseovers, key=lambda obj: (-obj.layer, -obj._space_rect.bottom))
                 
     def handle_event(self, event):
@@ -236,6 +450,34 @@ class LambdaTextGenerator(TextGenerator):
         return self._text
        
        
+class BoundTextGenerator(TextGenerator):
+    """Generates text from a lambda over an observable source. The lambda 
+    is only evaluated again after the source notifies of a change, so a 
+    label showing a value that hasn't changed costs nothing to check."""
+    
+    def __init__(self, source, lam):
+        self._lambda = lam
+        self._text = str(self._lambda())
+        self._stale = False
+        source.subscribe(self._source_changed)
+        
+    def _source_changed(self, source):
+        self._stale = True
+    
+    def text_changed(self):
+        if not self._stale:
+            return False
+        self._stale = False
+        text2 = str(self._lambda())
+        if text2 != self._text:
+            self._text = text2
+            return True
+        return False
+        
+    def get_text(self):
+        return self._text
+        
+        
 class CompositeTextGenerator(TextGenerator):
     def __init__(self, generators):
         self._generators = tuple(generators)
@@ -291,7 +533,7 @@ class WidgetBehavior(object):
     
     """Updater methods"""
     def _opaque_update(self, viewport, mousepos):
-        self._mouseover = self._disp_rect.collidepoint( mousepos)
+        self._mouseover = mousepos is not None and bool(self._disp_rect.collidepoint( mousepos))
         
     def _transparent_update(self, viewport, mousepos):
         self._mouseover = False
@@ -402,18 +644,47 @@ class BaseWidget(WidgetBehavior):
         for c in self._children:
             c.alt_draw(viewport)
             
+    def _in_world(self):
+        """Returns True if the widget follows a game object, and so can be 
+        culled when it is off screen."""
+        return False
+        
+    def _draw_bounds(self, viewport):
+        """Returns the screen area _draw_self may touch."""
+        return self._disp_rect.inflate(4,4)
+        
+    def _draw_key(self, viewport):
+        """Returns a value that changes whenever _draw_self would draw 
+        something different within the same bounds."""
+        return (self._mouseover, self.selected)
+        
+    def _pop_damage(self, viewport):
+        """Returns any screen areas changed since the last draw that the 
+        bounds and key don't account for."""
+        return []
+        
+    def _collect_draw_states(self, viewport, states, dirty):
+        """Records the bounds and key of this widget and its children for
+        InterfaceManager.draw_dirty, and returns the bounds of them all."""
+        bounds = self._draw_bounds(viewport)
+        states[self] = (bounds, self._draw_key(viewport))
+        dirty.extend(self._pop_damage(viewport))
+        for c in self._children:
+            bounds = bounds.union(c._collect_draw_states(viewport, states, dirty))
+        return bounds
+            
     def update(self, viewport, mousepos):
         
         if len(self._new_children) > 0:
             self._children.extend(self._new_children)
             self._new_children[:] = []
+            self._children.sort( key=lambda obj: obj.layer)
         
         self._disp_rect = self.get_disp_rect(viewport)
         self._update_handler(viewport, mousepos)
         for c in self._children:
             mo = c.update(viewport, mousepos)
             self._mouseover = self._mouseover or mo
-        self._children.sort( key=lambda obj: obj.layer)
         return self._mouseover
         
     def add_child(self, widg):
@@ -436,10 +707,22 @@ class BaseWidget(WidgetBehavior):
  
  
 class MapWidget(BaseWidget):
+    """Draws the terrain of the game map.
+    
+    The map is rendered in square chunks of about chunk_size pixels across,
+    one surface per chunk and zoom level, and each frame only blits the 
+    chunks in view. Chunk surfaces are kept in a least recently used cache
+    holding up to cache_pixels pixels, and dropped when the map reports a
+    change under them. When zoomed in so far that a single tile is larger
+    than a chunk, the visible tiles are drawn directly instead.
+    """
     update_rect = BaseWidget._relative_update_rect
     handle_event = BaseWidget._standard_event_handler
     get_disp_rect = BaseWidget._relative_get_disp_rect
     _update_handler = BaseWidget._opaque_update
+    
+    chunk_size = 512
+    cache_pixels = 8*1024*1024
 
     def __init__(self, manager, game):
         self.img = manager.controller.assets.get("water_tile")
@@ -459,43 +742,46 @@ class MapWidget(BaseWidget):
         
         BaseWidget.__init__(self, manager, (-wdims[0]/2,-wdims[1]/2,wdims[0],wdims[1]), LAYER_BASE)
         self._selectable = False
-        self.buffered_map = None
-        self.buffered_topleft = None
-        self.buffered_botright = None
         self.tile_size = 200
+        self._chunks = OrderedDict()
+        self._cached_pixels = 0
+        self._watched_map = None
+        self._damage = []
         
-    def _buffer_map(self, viewport, disp_rect, topleft, botright):
-        if self.buffered_map is None:
-            self.buffered_map = pygame.Surface(viewport.surface.get_size())
-            
-        #if self.buffered_topleft == topleft and self.buffered_botright == botright:
-        #    return
-        self.buffered_topleft = topleft
-        self.buffered_botright = botright
+    def _watch_map(self):
+        """Follows the game's current map, subscribing to its changes."""
+        map = self.game.map
+        if map is not self._watched_map:
+            if self._watched_map is not None:
+                self._watched_map.unsubscribe(self._map_changed)
+            map.subscribe(self._map_changed)
+            self._watched_map = map
+            self._chunks.clear()
+            self._cached_pixels = 0
+            self._damage.append(pygame.Rect((0,0), map.size))
             
+    def _drop_chunk(self, key):
+        w, h = self._chunks.pop(key).get_size()
+        self._cached_pixels -= w*h
             
-        self.buffered_map.fill((0,0,0,0))
+    def _map_changed(self, rect):
+        self._damage.append(rect)
+        for key in self._chunks.keys():
+            scale, n, cx, cy = key
+            if rect.left < (cx+1)*n and rect.right > cx*n and rect.top < (cy+1)*n and rect.bottom > cy*n:
+                self._drop_chunk(key)
+                
+    def _draw_tiles(self, viewport, surface, origin, x1, y1, x2, y2):
+        """Draws the map tiles in [x1,x2) x [y1,y2) onto surface, with tile
+        (0,0) at origin."""
         img1 = viewport.transform.scale(self.img, viewport.scale)
         img2 = viewport.transform.scale(self.img2, viewport.scale)
         img3 = viewport.transform.scale(self.img3, viewport.scale)
-
-        map_size = self.game.map.size        
-        offset_x = map_size[0]/2
-        offset_y = map_size[1]/2
-        limit1 = (topleft[0]/200 + offset_x, topleft[1]/200 + offset_y)
-        limit2 = (botright[0]/200 + offset_x, botright[1]/200 + offset_y)
-
-        x1 = max(0, int(math.floor(limit1[0]-0.5)))
-        y1 = max(0, int(math.floor(limit1[1]-0.5)))
-        x2 = min(map_size[0], int(math.ceil(limit2[0]+0.5)))
-        y2 = min(map_size[1], int(math.ceil(limit2[1]+0.5)))
-        
-        x_range = xrange(x1,x2)
-        y_range = xrange(y1,y2)
+        map = self.game.map
         
-        for u in x_range:
-            for v in y_range:
-                tile = self.game.map.get_terrain_at((u,v))
+        for u in xrange(x1, x2):
+            for v in xrange(y1, y2):
+                tile = map.get_terrain_at((u,v))
                 if tile == 0:
                     img = img1
                 elif tile == 1:
@@ -506,27 +792,76 @@ class MapWidget(BaseWidget):
                     img = None
                     
                 dim = img.get_rect()
-                pos = (disp_rect.x + u*dim.w, disp_rect.y + v*dim.h)
-                self.buffered_map.blit( img, pos)
+                pos = (origin[0] + u*dim.w, origin[1] + v*dim.h)
+                surface.blit( img, pos)
                 
                 if tile != 1:
-                    trans = self.game.map.get_tile_at((u,v))
+                    trans = map.get_tile_at((u,v))
                     if trans != 0:
                         trans_tile = self.transitions[trans]
                         trans_tile = viewport.transform.scale(trans_tile, viewport.scale)
-                        self.buffered_map.blit( trans_tile, pos)
-                                    
-        
+                        surface.blit( trans_tile, pos)
+                        
+    def _get_chunk(self, viewport, key):
+        """Returns the surface for the chunk with the given (scale, chunk 
+        tiles, x, y) key, rendering it if it is not cached."""
+        surface = self._chunks.pop(key, None)
+        if surface is None:
+            scale, n, cx, cy = key
+            map_size = self.game.map.size
+            x1, y1 = cx*n, cy*n
+            x2, y2 = min(x1+n, map_size[0]), min(y1+n, map_size[1])
+            tile = viewport.transform.scale(self.img, scale).get_size()
+            
+            surface = pygame.Surface(((x2-x1)*tile[0], (y2-y1)*tile[1]))
+            self._draw_tiles(viewport, surface, (-x1*tile[0], -y1*tile[1]), x1, y1, x2, y2)
+            w, h = surface.get_size()
+            self._cached_pixels += w*h
+            while self._chunks and self._cached_pixels > self.cache_pixels:
+                self._drop_chunk(next(iter(self._chunks)))
+        self._chunks[key] = surface
+        return surface
+        
+    def _draw_bounds(self, viewport):
+        return self._disp_rect
+        
+    def _pop_damage(self, viewport):
+        self._watch_map()
+        tile = viewport.transform.scale(self.img, viewport.scale).get_size()
+        x, y = self._disp_rect.topleft
+        damage = [pygame.Rect(x + r.x*tile[0], y + r.y*tile[1], r.w*tile[0], r.h*tile[1]) for r in self._damage]
+        self._damage = []
+        return damage
         
     def _draw_self(self, viewport, disp_rect):
+        self._watch_map()
         size = viewport.surface.get_size()
-        limit1 = viewport.translate_point((0,0), viewport_mod.SCREEN_TO_GAME)
-        limit2 = viewport.translate_point((size[0], size[1]), viewport_mod.SCREEN_TO_GAME)
+        topleft = viewport.translate_point((0,0), viewport_mod.SCREEN_TO_GAME)
+        botright = viewport.translate_point((size[0], size[1]), viewport_mod.SCREEN_TO_GAME)
         
-        self._buffer_map(viewport, disp_rect, limit1, limit2)
-        viewport.surface.blit(self.buffered_map, (0,0))
+        map_size = self.game.map.size        
+        offset_x = map_size[0]/2
+        offset_y = map_size[1]/2
+        limit1 = (topleft[0]/200 + offset_x, topleft[1]/200 + offset_y)
+        limit2 = (botright[0]/200 + offset_x, botright[1]/200 + offset_y)
 
+        x1 = max(0, int(math.floor(limit1[0]-0.5)))
+        y1 = max(0, int(math.floor(limit1[1]-0.5)))
+        x2 = min(map_size[0], int(math.ceil(limit2[0]+0.5)))
+        y2 = min(map_size[1], int(math.ceil(limit2[1]+0.5)))
         
+        viewport.surface.fill((0,0,0))
+        tile = viewport.transform.scale(self.img, viewport.scale).get_size()
+        n = self.chunk_size // max(max(tile), 1)
+        if n == 0:
+            self._draw_tiles(viewport, viewport.surface, disp_rect.topleft, x1, y1, x2, y2)
+            return
+            
+        for cx in xrange(x1 // n, (x2+n-1) // n):
+            for cy in xrange(y1 // n, (y2+n-1) // n):
+                chunk = self._get_chunk(viewport, (viewport.scale, n, cx, cy))
+                viewport.surface.blit(chunk, (disp_rect.x + cx*n*tile[0], disp_rect.y + cy*n*tile[1]))
+
     def _self_handle_event(self, event):
         if event.type == MOUSEBUTTONDOWN and event.button == 3:
             sel = self.game.selected_obj
@@ -648,16 +983,25 @@ class TextLabel(BaseWidget):
         self._textgen = text_gen
         self._origin = position
         self._font = manager.fonts[fontname]
+        self._text_cache = manager.text_cache
         self._regenerate()
         BaseWidget.__init__(self, manager, self._base_rect, layer)
         self._selectable = False        
         
     def _regenerate(self):
         text = self._textgen.get_text()
-        self._img = self._font.render( text, True, (0,0,0))
+        self._img = self._text_cache.render( self._font, text, (0,0,0))
         self._base_rect = self._img.get_rect()
         self._base_rect.topleft = self._origin
         
+    def _draw_bounds(self, viewport):
+        return pygame.Rect(self._disp_rect.topleft, self._img.get_size())
+        
+    def _draw_key(self, viewport):
+        if self._textgen.text_changed():
+            self._regenerate()
+        return (self._mouseover, self.selected, self._textgen.get_text())
+        
     def _draw_self(self, viewport, rect):
         if self._textgen.text_changed():
             self._regenerate()
@@ -674,17 +1018,12 @@ class TextButton(TextLabel):
         TextLabel.__init__(self, manager, position, fontname, text_gen, layer)
         self.set_lclick_action(action)        
         
-    def _regenerate(self):
-        text = self._textgen.get_text()
-        self._mainimg = self._font.render( text, True, (0,0,0))
-        self._altimg = self._font.render( text, True, (255,255,0))
-        self._img = self._mainimg
-        self._base_rect = self._mainimg.get_rect()
-        self._base_rect.topleft = self._origin
-
     def _draw_self(self, viewport, rect):
-        self._img = self._altimg if self._mouseover else self._mainimg
-        TextLabel._draw_self(self, viewport, rect)
+        if self._textgen.text_changed():
+            self._regenerate()
+        color = (255,255,0) if self._mouseover else (0,0,0)
+        self._img = self._text_cache.render( self._font, self._textgen.get_text(), color)
+        viewport.surface.blit( self._img, rect)
         
         
 class RadialContextMenu(BaseWidget):
@@ -733,6 +1072,12 @@ class RadialContextMenu(BaseWidget):
         if self._radius > 1:
             pygame.draw.circle( viewport.surface, color, point,
                                 int(self._radius*viewport.scale), 3)
+                                
+    def _draw_bounds(self, viewport):
+        radius = int(self._radius*viewport.scale) + 2
+        circle = pygame.Rect(0, 0, 2*radius, 2*radius)
+        circle.center = self._disp_rect.center
+        return BaseWidget._draw_bounds(self, viewport).union(circle)
         
     def translate_point(self, pos):
         return vector.Vec2d(pos) + self._space_rect.center
@@ -805,12 +1150,53 @@ class GameObjWidget(BaseWidget):
             self._selectable = False
             rect = obj_or_rect            
         BaseWidget.__init__(self,manager,rect,layer)
+        if self._game_object is not None:
+            self._game_object.moves.subscribe(self._object_moved)
 
 
     def update(self, viewport, mousepos):
         BaseWidget.update(self, viewport, mousepos)
         if self._game_object is not None:
             self.finished = self._game_object.finished
+            
+    def _in_world(self):
+        return self._game_object is not None
+        
+    def _object_moved(self, moves):
+        """Reports the top level widget holding this one as moved, so the 
+        interface reindexes it."""
+        root = self
+        while root._parent is not None:
+            root = root._parent
+        self.manager._world_moved.add(root)
+        
+    def _world_bounds(self):
+        """Returns the game world area the widget and its children will 
+        cover once the widget has followed its object."""
+        bounds = self._subtree_bounds()
+        if self._game_object is not None:
+            bounds.move_ip(self._follow_offset())
+        return bounds
+        
+    def _subtree_bounds(self):
+        bounds = self._space_rect.copy()
+        for c in self._children + self._new_children:
+            if isinstance(c, GameObjWidget):
+                bounds.union_ip(c._subtree_bounds())
+            else:
+                bounds.union_ip(c._space_rect)
+        return bounds
+        
+    def _follow_offset(self):
+        """Returns how far _follow_object would move the widget."""
+        obj = self._game_object.rect
+        return (obj.centerx - self._space_rect.centerx, obj.centery - self._space_rect.centery)
+
+    def _follow_object(self):
+        """Moves the widget to the current position of its game object."""
+        if self._base_rect.midbottom != self._game_object.rect.midbottom:
+            self._base_rect.midbottom = self._game_object.rect.midbottom
+            self.update_rect()
 
     def update_rect(self):
         if self._game_object is not None:
@@ -819,9 +1205,7 @@ class GameObjWidget(BaseWidget):
         
     def _update_handler(self, viewport, mousepos):
         if self._game_object is not None:
-            if self._base_rect.midbottom != self._game_object.rect.midbottom:
-                self._base_rect.midbottom = self._game_object.rect.midbottom
-                self.update_rect()
+            self._follow_object()
         BaseWidget._opaque_update(self, viewport, mousepos)
         
     def _draw_self(self, viewport, rect):
@@ -909,6 +1293,13 @@ class SpriteWidget(GameObjWidget):
     
         GameObjWidget.__init__(self, manager, obj_or_rect, rect, LAYER_GAME_FG)
         
+    def _follow_offset(self):
+        obj = self._game_object.rect
+        return (obj.centerx - self._base_rect.centerx, obj.bottom - self._base_rect.bottom)
+        
+    def _draw_key(self, viewport):
+        return (self._mouseover, self.selected, self.img)
+        
     def _draw_self(self, viewport, disp_rect):
         if self.img is not None:
             img = viewport.transform.scale(self.img, viewport.scale)
@@ -935,6 +1326,9 @@ class WorkspaceWidget(GameObjWidget):
         GameObjWidget.__init__(self, manager, obj, rect, layer)
         self.img = manager.controller.assets.get("workspace")
 
+    def _draw_key(self, viewport):
+        return (self.game_object.reserved,)
+        
     def _draw_self(self, viewport, disp_rect):
         img = viewport.transform.scale(self.img, viewport.scale)
         #viewport.surface.blit(img, disp_rect)
@@ -952,8 +1346,11 @@ class BuildingPlacerWidget(GameObjWidget):
         GameObjWidget.update(self, viewport, mousepos)
         topleft = self._space_rect.topleft
         botright = self._space_rect.bottomright
-        self.valid_pos = self.game_object.game.map.game_area_clear(topleft, botright)
+        self.valid_pos = self.game_object.game.placement.game_site_suitable(topleft, botright)
     
+    def _draw_key(self, viewport):
+        return (self.valid_pos,)
+        
     def _draw_self(self, viewport, disp_rect):
         color = (0,255,0) if self.valid_pos else (255,0,0)
         pygame.draw.rect(viewport.surface, color, disp_rect, 2)
@@ -987,21 +1384,29 @@ class StructWidget(SpriteWidget):
         
     def get_selection_menu(self):
         panel = Panel(self.manager, (0,0,200,600))
-        headline = CompositeTextGenerator( (StaticText("Available: "), LambdaTextGenerator(lambda: self._game_object.get_available_space(None))))
+        store = self._game_object.res_storage
+        if store is not None:
+            space = BoundTextGenerator(store, lambda: self._game_object.get_available_space(None))
+        else:
+            space = StaticText(str(self._game_object.get_available_space(None)))
+        headline = CompositeTextGenerator( (StaticText("Available: "), space))
         text = TextLabel(self.manager, (30, 30), 'medfont', headline)
         panel.add_child( text)
         offset = 1
         
-        store = self._game_object.res_storage
         if store is not None:
             for key in store._accepts:
-                text = TextLabel(self.manager, (30, 30+offset*30), 'medfont', CompositeTextGenerator([StaticText(key+': '), LambdaTextGenerator(lambda bound_key=key: "%.1f"%store.get_actual_contents(bound_key))]))
+                text = TextLabel(self.manager, (30, 30+offset*30), 'medfont', CompositeTextGenerator([StaticText(key+': '), BoundTextGenerator(store, lambda bound_key=key: "%.1f"%store.get_actual_contents(bound_key))]))
                 panel.add_child( text)
                 offset += 1
                 
         return panel
 
 class ResourcePileWidget( SpriteWidget):
+    def _draw_key(self, viewport):
+        bar_w = int(self._disp_rect.w * (1.0-self._game_object.decay_timer))
+        return SpriteWidget._draw_key(self, viewport) + (bar_w,)
+        
     def _draw_self(self, viewport, disp_rect):
         SpriteWidget._draw_self(self, viewport, disp_rect)
         bar_rect = disp_rect.copy()
@@ -1016,15 +1421,15 @@ class ResourcePileWidget( SpriteWidget):
 
     def get_selection_menu(self):
         panel = Panel(self.manager, (0,0,200,600))
-        headline = CompositeTextGenerator( (StaticText("Available: "), LambdaTextGenerator(lambda: self._game_object.get_available_space(None))))
+        store = self._game_object.res_storage
+        headline = CompositeTextGenerator( (StaticText("Available: "), BoundTextGenerator(store, lambda: self._game_object.get_available_space(None))))
         text = TextLabel(self.manager, (30, 30), 'medfont', headline)
         panel.add_child( text)
         
-        store = self._game_object.res_storage
         if store is not None:
             offset = 1
             for key in store._accepts:
-                text = TextLabel(self.manager, (30, 30+offset*30), 'medfont', CompositeTextGenerator([StaticText(key), LambdaTextGenerator(lambda bound_key=key: "%.3f"%store.get_actual_contents(bound_key))]))
+                text = TextLabel(self.manager, (30, 30+offset*30), 'medfont', CompositeTextGenerator([StaticText(key), BoundTextGenerator(store, lambda bound_key=key: "%.3f"%store.get_actual_contents(bound_key))]))
                 panel.add_child( text)
                 offset += 1
 
@@ -1039,6 +1444,14 @@ class ActorWidget(SpriteWidget):
         
         SpriteWidget.__init__(self, manager, obj, img)
         self.add_child(self.carry_widget)        
+        
+    def _draw_bounds(self, viewport):
+        #the carried sprite is swapped in while drawing, so cover it here
+        return SpriteWidget._draw_bounds(self, viewport).union(self.carry_widget._draw_bounds(viewport))
+        
+    def _draw_key(self, viewport):
+        load = self._game_object.carrying
+        return SpriteWidget._draw_key(self, viewport) + (load['type'] if load is not None else None,)
     
     def _draw_self(self, viewport, disp_rect):
         load = self._game_object.carrying
@@ -1053,9 +1466,9 @@ class ActorWidget(SpriteWidget):
 
     def get_selection_menu(self):
         panel = Panel(self.manager, (0,50,200,600))
-        statusgen = CompositeTextGenerator( (StaticText("O: "), LambdaTextGenerator(lambda: str(self.game_object.get_order_status()))))
+        statusgen = CompositeTextGenerator( (StaticText("O: "), BoundTextGenerator(self.game_object, lambda: self.game_object.get_order_status())))
         statustext = TextLabel(self.manager, (10, 30), 'smallfont', statusgen)
-        headline = CompositeTextGenerator( (StaticText("Carrying: "), LambdaTextGenerator(lambda: str(self.game_object.carrying))))
+        headline = CompositeTextGenerator( (StaticText("Carrying: "), BoundTextGenerator(self.game_object, lambda: self.game_object.carrying)))
         text = TextLabel(self.manager, (10, 60), 'medfont', headline)        
         panel.add_child( text)
         panel.add_child( statustext)
@@ -1068,6 +1481,9 @@ class HerdMemberWidget(SpriteWidget):
         SpriteWidget.__init__(self, manager, gameobj, sprite1)
         self.altsprite = sprite2
 
+    def _draw_key(self, viewport):
+        return SpriteWidget._draw_key(self, viewport) + (self.game_object._render_state['adult'],)
+
     def _draw_self(self, viewport, disp_rect):
         if self.game_object._render_state['adult']:
             SpriteWidget._draw_self(self, viewport, disp_rect)
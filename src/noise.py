@@ -50,4 +50,73 @@ class LayeredNoise2D(object):
         for i in xrange(self.layers):
             total += self.noise[i].val_at( (pos[0], pos[1])) * math.pow(self.falloff, i)
             
-        return total / self.factor
\ No newline at end of file
+        return total / self.factor
+
+_M32 = numpy.uint64(0xffffffff)
+
+def _lattice_hash(seed, ix, iy):
+    """Hashes integer lattice coordinates into floats in [0,1).
+    
+    The result depends only on the seed and the coordinates, so any part 
+    of the lattice can be reproduced independently of any other."""
+    h = (ix.astype(numpy.uint64) * numpy.uint64(0x27d4eb2d) 
+        + iy.astype(numpy.uint64) * numpy.uint64(0x165667b1) 
+        + numpy.uint64((seed * 0x9e3779b1) & 0xffffffff)) & _M32
+    h ^= h >> numpy.uint64(16)
+    h = (h * numpy.uint64(0x85ebca6b)) & _M32
+    h ^= h >> numpy.uint64(13)
+    h = (h * numpy.uint64(0xc2b2ae35)) & _M32
+    h ^= h >> numpy.uint64(16)
+    return h.astype(numpy.float64) / 4294967296.0
+    
+    
+class LatticeNoise2D(object):
+    """Seeded value noise over an unbounded integer lattice.
+    
+    Unlike Noise2D no seed table is allocated, lattice values are hashed from
+    the seed on demand. Positions are absolute (not normalized to the unit 
+    square), so any window of the noise field can be sampled on its own."""
+    
+    def __init__(self, seed, cell_size):
+        self.seed = seed
+        self.cell_size = float(cell_size)
+        
+    def values(self, xs, ys):
+        """Samples the noise at the given arrays of coordinates."""
+        fx = numpy.asarray(xs, numpy.float64) / self.cell_size
+        fy = numpy.asarray(ys, numpy.float64) / self.cell_size
+        ix = numpy.floor(fx)
+        iy = numpy.floor(fy)
+        tx = (1-numpy.cos((fx-ix) * math.pi)) * 0.5
+        ty = (1-numpy.cos((fy-iy) * math.pi)) * 0.5
+        ix = ix.astype(numpy.int64)
+        iy = iy.astype(numpy.int64)
+        
+        a = _lattice_hash(self.seed, ix, iy)*(1-tx) + _lattice_hash(self.seed, ix+1, iy)*tx
+        b = _lattice_hash(self.seed, ix, iy+1)*(1-tx) + _lattice_hash(self.seed, ix+1, iy+1)*tx
+        return a*(1-ty) + b*ty
+        
+    def val_at(self, pos):
+        return self.values([pos[0]], [pos[1]])[0]
+        
+
+class LayeredLatticeNoise2D(object):
+    """Layered (fractal) version of LatticeNoise2D. Each layer halves the
+    cell size of the previous one and is weighted down by falloff."""
+
+    def __init__(self, seed, cell_size, layers, falloff):
+        self.noise = [LatticeNoise2D((seed + 1013904223*f) & 0xffffffff, cell_size/math.pow(2,f)) for f in xrange(layers)]
+        self.layers = layers
+        self.falloff = falloff
+        self.factor = sum([math.pow(falloff,i) for i in xrange(layers)])
+        
+    def values(self, xs, ys):
+        """Samples the noise at the given arrays of coordinates."""
+        total = 0
+        for i in xrange(self.layers):
+            total = total + self.noise[i].values(xs, ys) * math.pow(self.falloff, i)
+            
+        return total / self.factor
+        
+    def val_at(self, pos):
+        return self.values([pos[0]], [pos[1]])[0]
@@ -0,0 +1,50 @@
+"""Provides change notification for objects the interface displays"""
+
+import weakref
+
+class Observable(object):
+    """Mixin for objects that announce their own changes.
+
+    Subscribed callbacks are called with the observable whenever notify is
+    called. Callbacks that are bound methods are held weakly, so an
+    observer that is dropped, like the text generator of a closed panel,
+    stops being called without having to unsubscribe.
+    """
+
+    def _observers(self):
+        try:
+            return self.__dict__['_observer_refs']
+        except KeyError:
+            refs = self.__dict__['_observer_refs'] = []
+            return refs
+
+    def _ref(self, callback):
+        owner = getattr(callback, 'im_self', None)
+        if owner is None:
+            return (None, callback)
+        return (weakref.ref(owner), callback.im_func)
+
+    def subscribe(self, callback):
+        """Registers callback to be called with this object after it changes."""
+        self._observers().append(self._ref(callback))
+
+    def unsubscribe(self, callback):
+        self._observers().remove(self._ref(callback))
+
+    def notify(self):
+        """Announces that this object changed."""
+        refs = self._observers()
+        if not refs:
+            return
+        dead = False
+        for owner, func in list(refs):
+            if owner is None:
+                func(self)
+                continue
+            obj = owner()
+            if obj is None:
+                dead = True
+            else:
+                func(obj, self)
+        if dead:
+            refs[:] = [r for r in refs if r[0] is None or r[0]() is not None]
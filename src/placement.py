@@ -0,0 +1,100 @@
+"""Provides building placement suitability grids"""
+
+import numpy
+
+import distance
+
+class PlacementMap(object):
+    """Scores every possible site for a structure footprint at once.
+
+    A site is suitable when the whole footprint is on dry land and clear of
+    existing structures. Suitable sites are scored by how close their
+    centre is to the nearest resource reservoir, from 1.0 right next to
+    one down towards 0, and unsuitable sites score 0.
+
+    Clearance comes from the map's summed-area table of blocked cells, which
+    covers structures through the occupancy layer. Grids are computed in one
+    vectorized pass and cached per footprint until the map or the game's
+    structure_version changes, so the placer and anything else choosing sites
+    can read them every frame.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self._key = None
+        self._resource_dist = None
+        self._grids = {}
+
+    def _refresh(self):
+        """Drops the cached grids if the map or its structures changed since
+        they were built."""
+        m = self.game.map
+        key = (id(m), m.version, self.game.structure_version)
+        if key == self._key:
+            return
+        self._key = key
+        self._grids.clear()
+
+        sources = [m.game_coords_to_map(o.rect.center) for o in self.game.reservoirs()]
+        reservoirs = numpy.zeros(m.size, numpy.bool_)
+        for cx, cy in sources:
+            if 0 <= cx < m.size[0] and 0 <= cy < m.size[1]:
+                reservoirs[cx][cy] = True
+        self._resource_dist = distance.manhattan_transform(reservoirs)[0]
+
+    def suitability(self, footprint):
+        """Returns the suitability of every site for the given footprint.
+
+        Args:
+            footprint: (width, height) of the structure in tiles
+
+        Returns:
+            A float array the size of the map, where entry [x,y] scores the
+            site with its top left tile at (x,y). Sites running off the map
+            score 0.
+        """
+        self._refresh()
+        footprint = tuple(footprint)
+        grid = self._grids.get(footprint)
+        if grid is None:
+            grid = self._grids[footprint] = self._compute(footprint)
+        return grid
+
+    def _compute(self, footprint):
+        m = self.game.map
+        fw, fh = footprint
+        grid = numpy.zeros(m.size, numpy.float32)
+        w, h = m.size[0]-fw+1, m.size[1]-fh+1
+        if fw <= 0 or fh <= 0 or w <= 0 or h <= 0:
+            return grid
+
+        sat = m.blocked_counts()
+        blocked = sat[fw:fw+w, fh:fh+h] - sat[:w, fh:fh+h] - sat[fw:fw+w, :h] + sat[:w, :h]
+        dist = self._resource_dist[fw//2:fw//2+w, fh//2:fh//2+h]
+        grid[:w, :h] = numpy.where(blocked == 0, 1.0/(1+dist), 0)
+        return grid
+
+    def site_suitable(self, topleft, botright):
+        """Returns True if the map area between the given corners (inclusive)
+        is a suitable site."""
+        footprint = (botright[0]-topleft[0]+1, botright[1]-topleft[1]+1)
+        if topleft[0] < 0 or topleft[1] < 0 or footprint[0] <= 0 or footprint[1] <= 0:
+            return False
+        grid = self.suitability(footprint)
+        if topleft[0] >= grid.shape[0] or topleft[1] >= grid.shape[1]:
+            return False
+        return bool(grid[topleft[0]][topleft[1]] > 0)
+
+    def game_site_suitable(self, topleft, botright):
+        """Game coordinate version of site_suitable."""
+        m = self.game.map
+        return self.site_suitable(m.game_coords_to_map(topleft), m.game_coords_to_map(botright))
+
+    def best_site(self, footprint):
+        """Returns the top left tile of the highest scoring site for the
+        footprint, or None if no site is suitable."""
+        grid = self.suitability(footprint)
+        x, y = numpy.unravel_index(grid.argmax(), grid.shape)
+        if grid[x][y] <= 0:
+            return None
+        return (int(x), int(y))
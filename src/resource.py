@@ -1,4 +1,5 @@
 import reservation
+import observable
 
 class Prototype(object):
     def __init__(self, tag, sprite=None, concrete=False):
@@ -60,7 +61,9 @@ class ResourceReservation(reservation.Reservation):
         self.tag = tag
         self.qty = qty        
         
-class ResourceStore(object):
+class ResourceStore(observable.Observable):
+    """Holds resources for a structure. Subscribers are notified whenever
+    the contents, or the reservations against them, change."""
 
     WAREHOUSE = 16
     RESERVOIR = 17
@@ -95,6 +98,7 @@ class ResourceStore(object):
             qty = min(self.contents[tag], amount)
             if (qty > 0):
                 self.contents[tag] -= qty
+                self.notify()
                 return {'type':tag, 'qty': qty}
             else:
                 return None
@@ -106,7 +110,7 @@ class ResourceStore(object):
             self.contents[resource['type']] += resource['qty']
         except KeyError:
             self.contents[resource['type']] = resource['qty']
-                
+        self.notify()
         return True        
 
     def deposit(self, resource):
@@ -115,10 +119,12 @@ class ResourceStore(object):
                     
         try:
             self.contents[resource['type']] += resource['qty']
+            self.notify()
             return True            
         except KeyError:
             if resource['type'] in self._accepts:
                 self.contents[resource['type']] = resource['qty']
+                self.notify()
                 return True
             
         return False
@@ -130,6 +136,7 @@ class ResourceStore(object):
             res = ResourceReservation(self.structure, tag, amount)
             res.make_ready()
             self._storage_reservations.append(res)
+            self.notify()
             return res
         else:
             return None
@@ -145,6 +152,7 @@ class ResourceStore(object):
             if qty > 0 or regen > 0:
                 res = ResourceReservation(self.structure, tag, amount)
                 self._resource_reservations.append(res)
+                self.notify()
             
                 if qty >= amount:
                     res.make_ready()
@@ -234,6 +242,7 @@ class ResourceStore(object):
                 if qty > 0:
                     self.withdraw(tag, qty) 
         
+        reserved = len(self._storage_reservations) + len(self._resource_reservations)
         for r in self._storage_reservations:
             r.update()
         self._storage_reservations[:] = [r for r in self._storage_reservations if r.valid]          
@@ -241,12 +250,17 @@ class ResourceStore(object):
         for r in self._resource_reservations:
             r.update()
         self._resource_reservations[:] = [r for r in self._resource_reservations if r.valid]
+        changed = reserved != len(self._storage_reservations) + len(self._resource_reservations)
         
         pending_res = [r for r in self._resource_reservations if not r.ready]
         for pres in pending_res:
             qty = self.get_unclaimed_contents(pres.tag)
             if qty >= pres.qty:
                 pres.make_ready()
+                changed = True
+                
+        if changed:
+            self.notify()
 
 class CompositeResourceStore(ResourceStore):
     def __init__(self, structure, stores=None, mode=ResourceStore.WAREHOUSE):
@@ -273,6 +287,10 @@ class CompositeResourceStore(ResourceStore):
                     raise ValueError("Overlapping resource acceptance: "+str(res))
             self._accepts.extend(store._accepts)
             self._stores.append(store)       
+            store.subscribe(self._store_changed)
+            
+    def _store_changed(self, store):
+        self.notify()
 
     def set_delta(self, tag, delta):
         for store in self._stores:
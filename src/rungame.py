@@ -3,6 +3,7 @@ import pygame
 import random
 import math
 import os.path
+import multiprocessing
 import numpy
 from pygame.locals import *
 
@@ -17,7 +18,9 @@ import actor
 import resource
 import tech
 import tilemap
+import placement
 import path
+import observable
 
 class CivilisApp( application.Application):
     """Game specific Application class."""
@@ -122,6 +125,41 @@ class AstarActivity( application.Activity):
             pygame.draw.lines(self.screen, (0,0,200), False, points)            
 
 
+class LoadingActivity( application.Activity):
+    """Loads the game assets in the background while showing a progress bar,
+    then hands them to the activity given as config. Assets are read from 
+    the asset bundle when it is up to date, and decoded images are cached 
+    in res/pixelcache, dropping the cached pixels of images no longer used."""
+    
+    def on_create(self, config):
+        application.Activity.on_create(self, config)
+        self.next_activity = config
+        self.screen = self.controller.screen
+        self.font = pygame.font.Font(None, 24)
+        self.assets = assetmanager.AssetManager("res/pixelcache")
+        if assetmanager.bundle_outdated("res/assets.txt", "res/assets.bundle"):
+            self.assets.load_set("res/assets.txt", multiprocessing.cpu_count())
+        else:
+            self.assets.load_bundle("res/assets.bundle", multiprocessing.cpu_count())
+        
+    def update(self):
+        if self.assets.progress() >= 1.0:
+            self.assets.prune_pixel_cache()
+            self.finish()
+            self.controller.start_activity(self.next_activity, self.assets)
+            
+    def draw(self):
+        self.screen.fill((0,0,0))
+        bar = pygame.Rect(0, 0, 400, 20)
+        bar.center = self.screen.get_rect().center
+        pygame.draw.rect(self.screen, (255,255,255), bar, 1)
+        filled = bar.inflate(-4, -4)
+        filled.w = int(filled.w * self.assets.progress())
+        pygame.draw.rect(self.screen, (255,255,255), filled, 0)
+        text = self.font.render("Loading", True, (255,255,255))
+        self.screen.blit(text, text.get_rect(midbottom=(bar.centerx, bar.top-10)))
+            
+
 class TestActivity( application.Activity):
     """Test activity for debugging."""
     
@@ -181,11 +219,18 @@ class TestActivity( application.Activity):
     def on_create(self, config):
         application.Activity.on_create(self, config)
         self.controller.set_fps_cap( 50)
+        self.dirty_rendering = True
+        self._last_cursor = pygame.Rect(0,0,0,0)
         self.vp = viewport.Viewport( self.controller.screen)
         self.vp.transform.set_rotation_interval( 5)
 
-        self.assets = assetmanager.AssetManager()
-        self.assets.load_set("res/assets.txt")
+        if config is not None:
+            self.assets = config
+        else:
+            self.assets = assetmanager.AssetManager()
+            self.assets.load_set("res/assets.txt")
+        self.vp.transform.add_atlas( self.assets.build_atlas())
+        self.vp.transform.prepare_scales( self.assets.get_images().values(), self.vp.zoom_scales())
         
         self.font = pygame.font.Font(None, 24)
         self.iface = interface.InterfaceManager(self)
@@ -195,6 +240,7 @@ class TestActivity( application.Activity):
         self.ticker = 1
         self.options = 5
         self.game.map = tilemap.Map((self.map_size,self.map_size))        
+        self.game.placement = placement.PlacementMap(self.game)
         
         self.game.resource_types = self.make_resource_tree()
         
@@ -241,12 +287,12 @@ class TestActivity( application.Activity):
         
         #hud
         panel = interface.Panel(self.iface, (0,0,800,30))
-        gen = interface.CompositeTextGenerator([interface.StaticText('Foodbuffer: '), interface.LambdaTextGenerator(lambda: self.director.food_buffer)])
+        gen = interface.CompositeTextGenerator([interface.StaticText('Foodbuffer: '), interface.BoundTextGenerator(self.director, lambda: self.director.food_buffer)])
         text = interface.TextLabel(self.iface, (10,10), 'medfont', gen)
         panel.add_child(text)
         gen = interface.CompositeTextGenerator([
                     interface.StaticText('Spirit: '), 
-                    interface.LambdaTextGenerator(lambda: self.director.get_total_available_stored_resources(('spirit',))),
+                    interface.BoundTextGenerator(self.game.stores, lambda: self.director.get_total_available_stored_resources(('spirit',))),
                     ])
         text = interface.TextLabel(self.iface, (400,10), 'medfont', gen)
         panel.add_child(text)        
@@ -262,6 +308,7 @@ class TestActivity( application.Activity):
         self.iface.update( self.vp)
         self.game.update()
         self.game.director.update()
+        self.vp.transform.prefetch( 0.002)
 
         pressed = pygame.key.get_pressed()
         if pressed[K_d]:
@@ -277,10 +324,19 @@ class TestActivity( application.Activity):
         application.Activity.draw(self)
         
         pos = pygame.mouse.get_pos()
+        radius = int(15*self.vp.scale)
         pygame.draw.circle( self.vp.surface, (255,255,255), pos, 
-                            int(15*self.vp.scale), int(self.vp.scale*4))
+                            radius, int(self.vp.scale*4))
 
-        self.iface.draw( self.vp)
+        if not self.dirty_rendering:
+            self.iface.draw( self.vp)
+            return None
+            
+        cursor = pygame.Rect(0, 0, 2*radius+2, 2*radius+2)
+        cursor.center = pos
+        rects = self.iface.draw_dirty( self.vp, (cursor, self._last_cursor))
+        self._last_cursor = cursor
+        return rects
 
     def handle_event(self, event):
         event = DictEvent(event)
@@ -322,9 +378,9 @@ class TestActivity( application.Activity):
             elif event.key == K_n:
                 self.game.map.grow_grass()
             elif event.key == K_k:
-                self.game.map.save("map.txt")
+                self.game.map.save_binary("map.bin")
             elif event.key == K_l:
-                self.game.map.load("map.txt")
+                self.game.load_map("map.bin")
             elif event.key == K_TAB:
                 testobj = game.BuildingPlacer(self.game, self.mouse_obj, "hut")
                 self.game.add_game_object(testobj)        
@@ -338,6 +394,13 @@ class TestActivity( application.Activity):
                         pygame.image.save(self.vp.surface, path)
                         break
                     i += 1
+            elif event.key == K_F2:
+                stats = self.vp.transform.stats()
+                print "transform cache: %d entries, %.1f MB, %d hits, %d misses, %d evictions" % (
+                    stats['entries'], stats['bytes']/1048576.0, stats['hits'], stats['misses'], stats['evictions'])
+                for name, s in sorted(stats['categories'].iteritems()):
+                    print "  %s: %d entries, %.1f MB, %d hits, %d misses, %d evictions" % (
+                        name, s['entries'], s['bytes']/1048576.0, s['hits'], s['misses'], s['evictions'])
 
 class ResearchMenuAction(interface.InterfaceAction):
             
@@ -384,8 +447,9 @@ class BuildItemAction(interface.InterfaceAction):
         director.build_menu.finished = True
             
 
-class GameDirector(object):
-    '''Generic factory/game state mutator'''
+class GameDirector(observable.Observable):
+    '''Generic factory/game state mutator. Subscribers are notified when the 
+    food buffer changes.'''
 
     def __init__(self, game_mgr, iface_mgr, asset_mgr, viewport=None):
         self.game = game_mgr
@@ -397,10 +461,20 @@ class GameDirector(object):
         self.mouse_obj = game.GameObject(self.game, (0,0), (0,0), float('inf'))
         self.game.add_game_object(self.mouse_obj)
         
-        self.food_buffer = 0
+        self._food_buffer = 0
         self.tech = tech.CivilisTechManager()
         self.research_menu = None
         
+    def _get_food_buffer(self):
+        return self._food_buffer
+        
+    def _set_food_buffer(self, value):
+        self._food_buffer = value
+        self.notify()
+        
+    food_buffer = property( _get_food_buffer, _set_food_buffer,
+                doc="""Food drawn from storage that actors have yet to eat""")
+        
     def update(self):
         self.mouse_obj.position = self.viewport.translate_point(pygame.mouse.get_pos(), viewport.SCREEN_TO_GAME)
 
@@ -656,7 +730,7 @@ class GameDirector(object):
 def run():
 
     app = CivilisApp()
-    app.start_activity(TestActivity, None)
+    app.start_activity(LoadingActivity, TestActivity)
     
     while app.update():
         app.draw()
@@ -0,0 +1,96 @@
+"""Provides a spatial index for finding rectangles by area or point"""
+
+import pygame
+
+class SpatialGrid(object):
+    """Uniform grid index over axis aligned rectangles.
+
+    Each item is filed under every grid cell its rectangle overlaps, so an
+    area or point query only looks at the items in the cells it covers.
+    Moving an item within the same cells just replaces its rectangle.
+    """
+
+    def __init__(self, cell_size=512):
+        self.cell_size = cell_size
+        self._cells = {}
+        self._items = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def _cell_range(self, rect):
+        cs = self.cell_size
+        return (rect.left // cs, rect.top // cs,
+                (rect.right-1) // cs + 1, (rect.bottom-1) // cs + 1)
+
+    def insert(self, item, rect):
+        """Adds item with the given rectangle, or moves it there if it is
+        already indexed."""
+        rect = pygame.Rect(rect)
+        entry = self._items.get(item)
+        cells = self._cell_range(rect)
+        if entry is not None:
+            if entry[1] == cells:
+                entry[0] = rect
+                return
+            self._unfile(item, entry[1])
+        self._items[item] = [rect, cells]
+        x1, y1, x2, y2 = cells
+        for x in xrange(x1, x2):
+            for y in xrange(y1, y2):
+                self._cells.setdefault((x,y), set()).add(item)
+
+    def remove(self, item):
+        """Removes item from the index.
+
+        Raises:
+            KeyError: If the item is not indexed.
+        """
+        rect, cells = self._items.pop(item)
+        self._unfile(item, cells)
+
+    def discard(self, item):
+        """Removes item from the index if it is there."""
+        if item in self._items:
+            self.remove(item)
+
+    def _unfile(self, item, cells):
+        x1, y1, x2, y2 = cells
+        for x in xrange(x1, x2):
+            for y in xrange(y1, y2):
+                bucket = self._cells[(x,y)]
+                bucket.discard(item)
+                if not bucket:
+                    del self._cells[(x,y)]
+
+    def get_rect(self, item):
+        return self._items[item][0]
+
+    def query(self, rect):
+        """Returns the set of items whose rectangles overlap rect."""
+        rect = pygame.Rect(rect)
+        found = set()
+        if rect.w <= 0 or rect.h <= 0:
+            return found
+        x1, y1, x2, y2 = self._cell_range(rect)
+        cells = self._cells
+
+        #very large areas are cheaper to answer by scanning the items
+        if (x2-x1)*(y2-y1) > len(cells):
+            return set(item for item, entry in self._items.iteritems() if entry[0].colliderect(rect))
+
+        for x in xrange(x1, x2):
+            for y in xrange(y1, y2):
+                bucket = cells.get((x,y))
+                if bucket:
+                    found.update(bucket)
+        return set(item for item in found if self._items[item][0].colliderect(rect))
+
+    def query_point(self, pos):
+        """Returns the set of items whose rectangles contain pos."""
+        cs = self.cell_size
+        bucket = self._cells.get((int(pos[0]) // cs, int(pos[1]) // cs), ())
+        return set(item for item in bucket if self._items[item][0].collidepoint(pos))
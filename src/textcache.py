@@ -0,0 +1,68 @@
+"""Provides a caching text renderer"""
+
+import re
+
+import pygame
+import autoloadcache
+import transform
+
+_NUMBER = re.compile(r"[0-9]+(?:\.[0-9]+)?")
+
+class TextCache(object):
+    """Renders text with pygame fonts, caching the results by font, text
+    and colour.
+
+    Text containing numbers is composed from separately cached runs: the
+    words around the numbers are rendered whole, and the numbers one glyph
+    at a time. A counter that changes every frame then costs a few blits
+    of cached glyphs instead of rasterizing the whole string again.
+    Rendered text is evicted least recently used first once it takes more
+    than budget bytes.
+    """
+
+    def __init__(self, budget=4*1024*1024):
+        self._cache = autoloadcache.AutoLoadCache( self, budget, transform.surface_bytes,
+                                                   lambda key: "composed" if key[3] else "rendered")
+
+    def render(self, font, text, color):
+        """Returns a surface with the text rendered antialiased in the
+        given font and colour, on a transparent background."""
+        color = tuple(color)
+        composed = len(text) > 1 and _NUMBER.search(text) is not None
+        return self._cache.get( (font, text, color, composed))
+
+    def stats(self):
+        """Returns the cache hit, miss and eviction counts, for whole
+        renders and composed strings."""
+        return self._cache.stats()
+
+    def _runs(self, text):
+        """Splits text into the parts it is composed from."""
+        runs = []
+        pos = 0
+        for match in _NUMBER.finditer(text):
+            if match.start() > pos:
+                runs.append(text[pos:match.start()])
+            runs.extend(match.group())
+            pos = match.end()
+        if pos < len(text):
+            runs.append(text[pos:])
+        return runs
+
+    def _cache_load(self, key):
+        """Autoloader method for cacheing"""
+        font, text, color, composed = key
+        if not composed:
+            return font.render( text, True, color)
+
+        parts = [self.render(font, run, color) for run in self._runs(text)]
+        width = sum(p.get_width() for p in parts)
+        height = max(p.get_height() for p in parts)
+        surface = pygame.Surface((width, height), pygame.SRCALPHA, 32, parts[0].get_masks())
+        x = 0
+        for p in parts:
+            #the parts don't overlap and the surface starts out transparent,
+            #so this copies their pixels along with their alpha
+            surface.blit(p, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            x += p.get_width()
+        return surface
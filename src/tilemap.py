@@ -1,69 +1,536 @@
 import path
+import distance
 
+import pygame
 import numpy
 import noise
 import math
+import os
 import pickle
+import random
+import struct
+import multiprocessing
+
+#binary map files: a fixed header followed by the raw uint8 terrain and tile arrays
+MAP_FILE_MAGIC = "CVMP"
+MAP_FILE_VERSION = 1
+TILE_SCHEME_VERSION = 1 #bump whenever the bit layout produced by compute_tile changes
+_MAP_HEADER = struct.Struct("<4sHHIIB11x")#magic, version, tile scheme, width, height, flags
+_HEADER_TILES_VALID = 1
+
+class MapFormatError(Exception):
+    pass
+
+def bordering(mask):
+    """Returns a boolean array flagging every cell that has at least one 
+    4-connected neighbour set in the given mask. Cells beyond the edge
+    of the array count as unset."""
+    near = numpy.zeros(mask.shape, bool)
+    near[1:,:] |= mask[:-1,:]
+    near[:-1,:] |= mask[1:,:]
+    near[:,1:] |= mask[:,:-1]
+    near[:,:-1] |= mask[:,1:]
+    return near
+
+def classify_terrain(values):
+    """Maps an array of noise values to terrain types (0 water, 1 grass, 2 desert)."""
+    return numpy.where(values < 0.35, 0, numpy.where(values < 0.45, 1, 2)).astype(numpy.uint8)
+
+def transition_tiles(grass, coords):
+    """Computes transition tile indices from a boolean grass mask that carries
+    a one cell border around the cells of interest. Bit i of a tile is set when
+    the neighbour at coords[i] is grass, just like Map.compute_tile."""
+    w, h = grass.shape[0]-2, grass.shape[1]-2
+    field = numpy.zeros((w, h), numpy.uint8)
+    for i, c in enumerate(coords):
+        field |= grass[1+c[0]:1+c[0]+w, 1+c[1]:1+c[1]+h].astype(numpy.uint8) << i
+    return field
+
+#noise parameters shared by every chunk, see generate_chunk
+FEATURE_SIZE = 15
+NOISE_LAYERS = 4
+NOISE_FALLOFF = 0.75
+
+_OFF_WORLD = 255
+
+def chunk_shape(chunk, chunk_size, world_size):
+    """Returns the dimensions of the given chunk, chunks along the far
+    edges of the world are clipped to it."""
+    return (min(chunk_size, world_size[0]-chunk[0]*chunk_size),
+            min(chunk_size, world_size[1]-chunk[1]*chunk_size))
+
+def generate_chunk(seed, chunk, chunk_size, world_size):
+    """Generates the terrain and transition tiles of a single chunk.
+
+    The result depends only on the arguments. The seeded lattice noise is
+    sampled over the chunk plus a two cell border, which is all grass growth
+    and transition tiles along the chunk's edges need to come out exactly as
+    if the whole world had been generated at once.
+
+    Returns:
+        A (terrain, tiles) pair of uint8 arrays.
+    """
+    x1, y1 = chunk[0]*chunk_size, chunk[1]*chunk_size
+    w, h = chunk_shape(chunk, chunk_size, world_size)
+    gen = noise.LayeredLatticeNoise2D(seed, FEATURE_SIZE, NOISE_LAYERS, NOISE_FALLOFF)
+
+    xs, ys = numpy.mgrid[x1-2:x1+w+2, y1-2:y1+h+2]
+    terrain = classify_terrain(gen.values(xs, ys))
+    terrain[(xs < 0) | (ys < 0) | (xs >= world_size[0]) | (ys >= world_size[1])] = _OFF_WORLD
+    terrain[(terrain == 2) & bordering(terrain == 0)] = 1
+
+    tiles = transition_tiles(terrain[1:-1,1:-1] == 1, BaseMap.coords)
+    return terrain[2:-2,2:-2].copy(), tiles
+
+def _generate_chunk_job(args):
+    return generate_chunk(*args)
+    
+def generate_world(dims, seed, chunk_size=64, workers=1):
+    """Generates the terrain and transition tiles for a whole world.
+    
+    The world is cut into chunks that are generated independently, across
+    a pool of worker processes if workers is more than 1, and then stitched
+    back together. Every chunk already accounts for its neighbours along 
+    its borders, so the result is identical for any worker count.
+    
+    Returns:
+        A (terrain, tiles) pair of uint8 arrays.
+    """
+    keys = [(cx, cy) for cx in xrange((dims[0]+chunk_size-1) // chunk_size)
+                     for cy in xrange((dims[1]+chunk_size-1) // chunk_size)]
+    jobs = [(seed, key, chunk_size, dims) for key in keys]
+    
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunks = pool.map(_generate_chunk_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunks = [_generate_chunk_job(job) for job in jobs]
+        
+    terrain = numpy.zeros(dims, numpy.uint8)
+    tiles = numpy.zeros(dims, numpy.uint8)
+    for key, (chunk_terrain, chunk_tiles) in zip(keys, chunks):
+        x, y = key[0]*chunk_size, key[1]*chunk_size
+        w, h = chunk_terrain.shape
+        terrain[x:x+w, y:y+h] = chunk_terrain
+        tiles[x:x+w, y:y+h] = chunk_tiles
+    return terrain, tiles
 
 class PathableMap(path.PathMap):
+    def __init__(self, tiles, exempt=()):
+        path.PathMap.__init__(self, tiles)
+        self.exempt = set(exempt)
+        
+    def valid_tile(self, pos):
+        #tiles are indexed [x][y] here, unlike the [y][x] of PathMap
+        return 0 <= pos[0] < self.shape[0] and 0 <= pos[1] < self.shape[1]
+        
     def tile_passable(self, pos):
-        return self.tiles[pos[0]][pos[1]] > 0
+        return self.tiles[pos[0]][pos[1]] > 0 or pos in self.exempt
+
+class MapLayers(object):
+    """Container for the per-cell layers of a map.
+    
+    Every layer shares the map's dimensions and is stored in the narrowest
+    dtype its values fit in: terrain types and transition tile indices are 
+    bytes, occupancy is a count of structures and passability is a flag.
+    """
+    
+    dtypes = (
+        ('terrain', numpy.uint8),
+        ('tiles', numpy.uint8),
+        ('occupancy', numpy.uint8),
+        ('passable', numpy.bool_),
+    )
+    
+    def __init__(self, dims):
+        self.size = tuple(dims)
+        for name, dtype in self.dtypes:
+            setattr(self, name, numpy.zeros(dims, dtype))
+            
+    def set(self, name, array):
+        """Replaces the named layer, converting the array to the layer's dtype
+        if needed. Arrays already of the right dtype (including memory maps)
+        are used without copying."""
+        dtype = dict(self.dtypes)[name]
+        array = numpy.asarray(array, dtype)
+        if array.shape != self.size:
+            raise ValueError("Layer %s has shape %s, expected %s" % (name, array.shape, self.size))
+        setattr(self, name, array)
+            
+    def memory_usage(self):
+        """Returns the number of bytes held by each layer, keyed by name."""
+        return dict((name, getattr(self, name).nbytes) for name, dtype in self.dtypes)
+        
 
-class Map(object):
+class BaseMap(object):
+    """Storage independent tile map behaviour. Subclasses provide 
+    get_terrain_at, get_tile_at, map_area_clear and find_map_path.
+    
+    Every change to the map is published as a dirty rectangle of map cells.
+    Rectangles are passed to each subscribed callback, and the change bumps version along with the version of every
+    block of version_block x version_block cells it touched. Caches can 
+    either subscribe, or remember region_version for the area they cover
+    and compare it later.
+    """
     
     coords = ( (0,-1), (1,0), (0,1), (-1,0), (1,-1), (1,1), (-1,1), (-1,-1), )
+    version_block = 16
     
-    def __init__(self, dims, tilesize=(200,200), filepath=None):
-        assert(len(dims) == 2)
-        self.terrain = numpy.zeros(dims, numpy.int)
-        self.tiles = numpy.zeros(dims, numpy.int)
+    def __init__(self, dims, tilesize):
         self.size = dims
         self.tilesize = tilesize
+        self.version = 0
+        self._subscribers = []
+        self._resize_versions()
+        
+    def _resize_versions(self):
+        """Sizes the block version grid to the map, starting every block at 
+        the current version so versions never go backwards."""
+        b = self.version_block
+        shape = ((self.size[0]+b-1) // b, (self.size[1]+b-1) // b)
+        self._block_versions = numpy.empty(shape, numpy.int64)
+        self._block_versions.fill(self.version)
+        
+    def subscribe(self, callback):
+        """Registers callback to be called with a pygame.Rect of map cells 
+        whenever that area changes. Callbacks run while the map is being 
+        updated, so they should note the change rather than read the map."""
+        self._subscribers.append(callback)
+        
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+        
+    def _publish(self, x1, y1, x2, y2):
+        """Announces that the cells in [x1,x2) x [y1,y2) changed."""
+        if x2 <= x1 or y2 <= y1:
+            return
+        self.version += 1
+        b = self.version_block
+        self._block_versions[x1//b:(x2+b-1)//b, y1//b:(y2+b-1)//b] = self.version
+        
+        rect = pygame.Rect(x1, y1, x2-x1, y2-y1)
+        for callback in list(self._subscribers):
+            callback(rect)
+            
+    def region_version(self, topleft, botright):
+        """Returns the version of the most recent change touching the cells
+        between the given corners (inclusive). Changes to nearby cells in 
+        the same block also count, so a cache may be refreshed needlessly but
+        is never left stale."""
+        b = self.version_block
+        x1, y1 = max(topleft[0], 0) // b, max(topleft[1], 0) // b
+        x2, y2 = min(botright[0], self.size[0]-1) // b + 1, min(botright[1], self.size[1]-1) // b + 1
+        if x2 <= x1 or y2 <= y1:
+            return 0
+        return int(self._block_versions[x1:x2, y1:y2].max())
+
+    def terrain_equal(self, pos, value):
+        if pos[0] < 0 or pos[0] >= self.size[0]:
+            return False
+        elif pos[1] < 0 or pos[1] >= self.size[1]:
+            return False
+        else:
+            return self.get_terrain_at(pos) == value
+
+    def compute_tile(self, pos):
+        field = 0        
+        coords = self.coords
+        for i in xrange(8):
+            if self.terrain_equal( (pos[0]+coords[i][0], pos[1]+coords[i][1]), 1):
+                field += math.pow(2, i)
+        return int(field)
+
+    def game_coords_to_map(self, coords):
+        return (int((coords[0] + self.size[0]*self.tilesize[0]/2)/self.tilesize[0]), int((coords[1] + self.size[1]*self.tilesize[1]/2)/self.tilesize[1]))
+
+    def map_coords_to_game(self, pos, center=True):
+        if center:
+            pos = (pos[0]+0.5, pos[1]+0.5)
+        return (pos[0]*self.tilesize[0] - (self.size[0]*self.tilesize[0]/2), pos[1]*self.tilesize[1] - (self.size[1]*self.tilesize[1]/2))
+
+    def game_area_clear(self, topleft, botright):
+        return self.map_area_clear( self.game_coords_to_map(topleft), self.game_coords_to_map(botright))
+
+    def game_rect_to_map(self, rect):
+        """Returns the (x1, y1, x2, y2) bounds of the cells covered by a game
+        rectangle, with x2 and y2 exclusive and clipped to the map."""
+        x1, y1 = self.game_coords_to_map(rect.topleft)
+        x2, y2 = self.game_coords_to_map((rect.right-1, rect.bottom-1))
+        return max(x1, 0), max(y1, 0), min(x2+1, self.size[0]), min(y2+1, self.size[1])
+
+    def find_game_path(self, start, finish):        
+        base_path = self.find_map_path(self.game_coords_to_map(start), self.game_coords_to_map(finish))
+        if base_path is None:
+            return None
+        
+        final_path = [self.map_coords_to_game(p) for p in base_path]
+        final_path[0] = start
+        final_path[-1] = finish
+        
+        return final_path
+
+class Map(BaseMap):
+    
+    def __init__(self, dims, tilesize=(200,200), filepath=None, seed=None, workers=1):
+        """Generates a new map with the given dimensions, or opens the
+        binary map file at filepath instead if one is given.
+        
+        Generation is deterministic for a given seed, whatever the number
+        of worker processes used. A random seed is picked if none is given.
+        """
+        assert(len(dims) == 2)
+        BaseMap.__init__(self, dims, tilesize)
+        self.layers = MapLayers(dims)
+        self._blocked_sat = None
+        self._passable_valid = False
+        self._distances = None
+        
+        if filepath is not None:
+            self.seed = None
+            self.load_binary(filepath)
+            return
+        
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.terrain, self.tiles = generate_world(dims, self.seed, workers=workers)
         
-        ndims = (max(dims[0]/15, 1), max(dims[1]/15, 1))
-        gen = noise.LayeredNoise2D(ndims, 4, 0.75)
+    def _get_terrain(self):
+        return self.layers.terrain
         
-        sample = 0.0
-        sample_size = 0
-        for x in xrange(dims[0]):
-            for y in xrange(dims[1]):
-                val = gen.val_at( (float(x)/dims[0], float(y)/dims[1]))
-                sample += val
-                sample_size += 1
+    def _set_terrain(self, terrain):
+        self.layers.set('terrain', terrain)
+        self._rebuild_derived()
+        self._publish(0, 0, self.size[0], self.size[1])
+        
+    terrain = property(_get_terrain, _set_terrain, 
+                doc="""Terrain type of every cell, see MapLayers""")
+    
+    def _get_tiles(self):
+        return self.layers.tiles
+        
+    def _set_tiles(self, tiles):
+        self.layers.set('tiles', tiles)
+        
+    tiles = property(_get_tiles, _set_tiles,
+                doc="""Transition tile index of every cell, see MapLayers""")
                 
-                if val < 0.35:
-                    self.terrain[x][y] = 0
-                elif val < 0.45:
-                    self.terrain[x][y] = 1
-                else:
-                    self.terrain[x][y] = 2
-                    
-        self.grow_grass()                    
-        average = sample / sample_size
-        self.compute_tiles()
+    def memory_usage(self):
+        """Returns the number of bytes used by each map layer and derived
+        table, keyed by name."""
+        usage = self.layers.memory_usage()
+        if self._blocked_sat is not None:
+            usage['blocked_sat'] = self._blocked_sat.nbytes
+        return usage
 
     def save(self, filepath):
         print pickle.dump(self.terrain, open(filepath, "w"))
         
     def load(self, filepath):
-        self.terrain = pickle.load( open(filepath, "r"))
+        self.layers.set('terrain', pickle.load( open(filepath, "r")))
         self.compute_tiles()
         
+    def save_binary(self, filepath):
+        """Saves the terrain and transition tiles in the binary map format."""
+        header = _MAP_HEADER.pack(MAP_FILE_MAGIC, MAP_FILE_VERSION, TILE_SCHEME_VERSION, 
+                                  self.size[0], self.size[1], _HEADER_TILES_VALID)
+        
+        #serialize everything before truncating the file, it may be the one we're mapped onto
+        data = header + self.terrain.astype('<u1').tobytes() + self.tiles.astype('<u1').tobytes()
+        with open(filepath, "wb") as f:
+            f.write(data)
+            
+    def load_binary(self, filepath):
+        """Opens a binary map file.
+        
+        The terrain and tile arrays are memory mapped copy-on-write, so 
+        pages are only read from disk when touched and edits never reach 
+        the file. The stored tiles are used as is unless they were written
+        with a different tile scheme, in which case they are recomputed.
+        Map files hold no structures, so the occupancy layer is cleared; 
+        Game.load_map stamps the game's structures back onto it.
+        
+        Raises:
+            MapFormatError: If the file is not a binary map file, is of 
+            an unsupported version, or is cut short.
+        """
+        with open(filepath, "rb") as f:
+            header = f.read(_MAP_HEADER.size)
+        if len(header) < _MAP_HEADER.size:
+            raise MapFormatError("Truncated map file: "+filepath)
+            
+        magic, version, scheme, width, height, flags = _MAP_HEADER.unpack(header)
+        if magic != MAP_FILE_MAGIC:
+            raise MapFormatError("Not a map file: "+filepath)
+        if version != MAP_FILE_VERSION:
+            raise MapFormatError("Unsupported map file version: "+str(version))
+        
+        dims = (width, height)
+        offset = _MAP_HEADER.size
+        tiles_valid = scheme == TILE_SCHEME_VERSION and flags & _HEADER_TILES_VALID
+        if os.path.getsize(filepath) < offset + width*height*(2 if tiles_valid else 1):
+            raise MapFormatError("Truncated map file: "+filepath)
+        
+        #nothing is changed until the file is known to be whole
+        terrain = numpy.memmap(filepath, '<u1', 'c', offset, dims)
+        tiles = numpy.memmap(filepath, '<u1', 'c', offset+width*height, dims) if tiles_valid else None
+        if self.layers.size != dims:
+            self.layers = MapLayers(dims)
+            self.size = dims
+            self._resize_versions()
+        else:
+            self.layers.occupancy[...] = 0
+        self.layers.set('terrain', terrain)
+        
+        if tiles is not None:
+            self.layers.set('tiles', tiles)
+        else:
+            self._compute_tile_region(0, 0, width, height)
+        self._rebuild_derived()
+        self._publish(0, 0, width, height)
+        
     def compute_tiles(self):
-        for x in xrange(self.size[0]):
-            for y in xrange(self.size[1]):
-                self.set_tile_at((x,y), self.compute_tile((x,y)))
-                
+        """Recomputes every transition tile, along with any other data derived
+        from the terrain. Needed after writing to the terrain array directly."""
+        self._compute_tile_region(0, 0, self.size[0], self.size[1])
+        self._rebuild_derived()
+        self._publish(0, 0, self.size[0], self.size[1])
+        
+    def _rebuild_derived(self):
+        """Drops the data derived from the terrain so it is rebuilt from 
+        scratch when next needed. Nothing is read from the terrain here, so 
+        memory mapped maps stay unpaged until used."""
+        self._blocked_sat = None
+        self._passable_valid = False
+        self._distances = None
+        
+    def distance_field(self):
+        """Returns the map's TerrainDistanceField, creating it if needed."""
+        if self._distances is None:
+            self._distances = distance.TerrainDistanceField(self)
+        return self._distances
+        
+    def nearest_terrain(self, pos, terrain_type):
+        """Returns the closest cell of the given terrain type to pos, or None
+        if the map has none."""
+        return self.distance_field().nearest(pos, terrain_type)
+        
+    def distance_to_shore(self, pos):
+        """Returns the Manhattan distance from a land cell to the nearest water,
+        or from a water cell to the nearest land. None if there is no shore."""
+        if self.get_terrain_at(pos) == 0:
+            return self.distance_field().distance(pos, distance.LAND)
+        return self.distance_field().distance(pos, 0)
+        
+    def passability(self):
+        """Returns the passability layer, True wherever a cell is neither 
+        water nor occupied by a structure."""
+        if not self._passable_valid:
+            self._update_passable(0, 0, self.size[0], self.size[1])
+            self._passable_valid = True
+        return self.layers.passable
+        
+    def _update_passable(self, x1, y1, x2, y2):
+        layers = self.layers
+        layers.passable[x1:x2, y1:y2] = (layers.terrain[x1:x2, y1:y2] != 0) & (layers.occupancy[x1:x2, y1:y2] == 0)
+        
+    def _compute_tile_region(self, x1, y1, x2, y2):
+        """Recomputes the transition tiles for the cells in [x1,x2) x [y1,y2)
+        in one vectorized pass, equivalent to calling compute_tile on each."""
+        w, h = x2-x1, y2-y1
+        if w <= 0 or h <= 0:
+            return
+        
+        #grass mask of the region plus a one cell border, off-map cells unset
+        grass = numpy.zeros((w+2, h+2), bool)
+        sx1, sy1 = max(x1-1, 0), max(y1-1, 0)
+        sx2, sy2 = min(x2+1, self.size[0]), min(y2+1, self.size[1])
+        grass[sx1-x1+1:sx2-x1+1, sy1-y1+1:sy2-y1+1] = self.terrain[sx1:sx2, sy1:sy2] == 1
+        self.tiles[x1:x2, y1:y2] = transition_tiles(grass, self.coords)
+        
+    def _terrain_changed(self, x1, y1, x2, y2):
+        """Updates derived data after the terrain in [x1,x2) x [y1,y2) changed.
+        
+        Only the transition tiles of the changed cells and their immediate 
+        neighbours are recomputed, and the affected area is published."""
+        if self._passable_valid:
+            self._update_passable(x1, y1, x2, y2)
+        if self._blocked_sat is not None:
+            self._update_blocked_sat(x1, y1, x2, y2)
+        if self._distances is not None:
+            self._distances.terrain_changed(x1, y1, x2, y2)
+            
+        x1, y1 = max(x1-1, 0), max(y1-1, 0)
+        x2, y2 = min(x2+1, self.size[0]), min(y2+1, self.size[1])
+        if x2 <= x1 or y2 <= y1:
+            return
+        self._compute_tile_region(x1, y1, x2, y2)
+        self._publish(x1, y1, x2, y2)
+        
+    def add_occupant(self, rect):
+        """Marks the cells under a structure's game rectangle as occupied."""
+        x1, y1, x2, y2 = self.game_rect_to_map(rect)
+        if x2 > x1 and y2 > y1:
+            #the count saturates rather than wrapping back to unoccupied
+            occupancy = self.layers.occupancy[x1:x2, y1:y2]
+            numpy.minimum(occupancy, 254, occupancy)
+            occupancy += 1
+            self._occupancy_changed(x1, y1, x2, y2)
+        
+    def remove_occupant(self, rect):
+        """Releases the cells marked by add_occupant for the same rectangle."""
+        x1, y1, x2, y2 = self.game_rect_to_map(rect)
+        if x2 > x1 and y2 > y1:
+            occupancy = self.layers.occupancy[x1:x2, y1:y2]
+            numpy.maximum(occupancy, 1, occupancy)
+            occupancy -= 1
+            self._occupancy_changed(x1, y1, x2, y2)
+            
+    def _occupancy_changed(self, x1, y1, x2, y2):
+        if self._passable_valid:
+            self._update_passable(x1, y1, x2, y2)
+        if self._blocked_sat is not None:
+            self._update_blocked_sat(x1, y1, x2, y2)
+        self._publish(x1, y1, x2, y2)
+        
+    def blocked_counts(self):
+        """Returns the summed-area table of impassable cells, building it if 
+        needed.
+        
+        Entry [x,y] holds the number of water or occupied cells in 
+        [0,x) x [0,y), so the blocked cells in any rectangle can be counted 
+        from its four corners."""
+        if self._blocked_sat is None:
+            sat = numpy.zeros((self.size[0]+1, self.size[1]+1), numpy.int32)
+            sat[1:,1:] = (~self.passability()).cumsum(0).cumsum(1)
+            self._blocked_sat = sat
+        return self._blocked_sat
+        
+    def _update_blocked_sat(self, x1, y1, x2, y2):
+        """Patches the summed-area table after the passability of 
+        [x1,x2) x [y1,y2) changed. The old blocked cells are read back out of
+        the table itself, and only the entries below and to the right of the
+        region move."""
+        sat = self._blocked_sat
+        old = sat[x1+1:x2+1, y1+1:y2+1] - sat[x1:x2, y1+1:y2+1] - sat[x1+1:x2+1, y1:y2] + sat[x1:x2, y1:y2]
+        delta = (~self.layers.passable[x1:x2, y1:y2]).astype(numpy.int32) - old
+        if delta.any():
+            spread = numpy.zeros((self.size[0]-x1, self.size[1]-y1), numpy.int32)
+            spread[:x2-x1, :y2-y1] = delta
+            sat[x1+1:, y1+1:] += spread.cumsum(0).cumsum(1)
+        
     def grow_grass(self):
-        neighbors = ((1,0),(-1,0),(0,1),(0,-1))
-        dims = self.size
-        for x in xrange(dims[0]):
-            for y in xrange(dims[1]):
-                if self.terrain[x][y] == 2:
-                    for c in neighbors:
-                        if self.terrain_equal((x+c[0],y+c[1]),0):
-                            self.terrain[x][y] = 1
-                            break
+        """Converts every desert tile bordering on water into grass.
+        
+        The whole map is handled in one masked assignment, so repeated
+        calls cost a handful of array operations regardless of map size."""
+        grown = (self.terrain == 2) & bordering(self.terrain == 0)
+        xs, ys = numpy.nonzero(grown)
+        if len(xs) > 0:
+            self.terrain[grown] = 1
+            self._terrain_changed(xs.min(), ys.min(), xs.max()+1, ys.max()+1)
         
     def get_terrain_at(self, pos):
         if pos[0] < 0 or pos[1] < 0:
@@ -74,23 +541,30 @@ class Map(object):
         if pos[0] < 0 or pos[1] < 0:
             raise IndexError("Index out of bounds: "+str(pos))        
         self.terrain[pos[0]][pos[1]] = value
+        self._terrain_changed(pos[0], pos[1], pos[0]+1, pos[1]+1)
+        
+    def set_terrain_rect(self, topleft, botright, value):
+        """Sets every cell between the given corners (inclusive) to the given
+        terrain value. The rectangle is clipped to the map."""
+        x1, y1 = max(topleft[0], 0), max(topleft[1], 0)
+        x2, y2 = min(botright[0]+1, self.size[0]), min(botright[1]+1, self.size[1])
+        if x2 <= x1 or y2 <= y1:
+            return
+        self.terrain[x1:x2, y1:y2] = value
+        self._terrain_changed(x1, y1, x2, y2)
+        
+    def paint_terrain(self, center, radius, value):
+        """Sets every cell within radius of the center cell to the given 
+        terrain value. The brush is clipped to the map."""
+        x1, y1 = max(center[0]-radius, 0), max(center[1]-radius, 0)
+        x2, y2 = min(center[0]+radius+1, self.size[0]), min(center[1]+radius+1, self.size[1])
+        if x2 <= x1 or y2 <= y1:
+            return
+        dx, dy = numpy.ogrid[x1-center[0]:x2-center[0], y1-center[1]:y2-center[1]]
+        brush = dx*dx + dy*dy <= radius*radius
+        self.terrain[x1:x2, y1:y2][brush] = value
+        self._terrain_changed(x1, y1, x2, y2)
 
-    def terrain_equal(self, pos, value):
-        if pos[0] < 0 or pos[0] >= self.size[0]:
-            return False
-        elif pos[1] < 0 or pos[1] >= self.size[1]:
-            return False
-        else:
-            return self.get_terrain_at(pos) == value
-
-    def compute_tile(self, pos):
-        field = 0        
-        coords = self.coords
-        for i in xrange(8):
-            if self.terrain_equal( (pos[0]+coords[i][0], pos[1]+coords[i][1]), 1):
-                field += math.pow(2, i)
-        return int(field)
-            
     def get_tile_at(self, pos):
         if pos[0] < 0 or pos[1] < 0:
             raise IndexError("Index out of bounds: "+str(pos))
@@ -101,30 +575,58 @@ class Map(object):
             raise IndexError("Index out of bounds: "+str(pos))        
         self.tiles[pos[0]][pos[1]] = value
         
-    def game_coords_to_map(self, coords):
-        return (int((coords[0] + self.size[0]*self.tilesize[0]/2)/self.tilesize[0]), int((coords[1] + self.size[1]*self.tilesize[1]/2)/self.tilesize[1]))
-
-    def map_coords_to_game(self, pos, center=True):
-        if center:
-            pos = (pos[0]+0.5, pos[1]+0.5)
-        return (pos[0]*self.tilesize[0] - (self.size[0]*self.tilesize[0]/2), pos[1]*self.tilesize[1] - (self.size[1]*self.tilesize[1]/2))
-    
     def map_area_clear(self, topleft, botright):
-        try:
-            for x in xrange(topleft[0], botright[0]+1):
-                for y in xrange(topleft[1], botright[1]+1):
-                    if self.get_terrain_at((x,y)) == 0:
-                        return False
-                    
+        """Returns True if there is no water or structure between the given 
+        corners (inclusive). Areas reaching off the map are never clear."""
+        x1, y1 = topleft
+        x2, y2 = botright[0]+1, botright[1]+1
+        if x2 <= x1 or y2 <= y1:
             return True
-        except IndexError:
+        if x1 < 0 or y1 < 0 or x2 > self.size[0] or y2 > self.size[1]:
             return False
+        
+        sat = self.blocked_counts()
+        return bool(sat[x2,y2] - sat[x1,y2] - sat[x2,y1] + sat[x1,y1] == 0)
+        
+    def map_areas_clear(self, topleft, botright):
+        """Batch version of map_area_clear, taking (n,2) arrays of corners
+        and returning an array of n booleans."""
+        topleft = numpy.asarray(topleft, numpy.int64).reshape(-1, 2)
+        botright = numpy.asarray(botright, numpy.int64).reshape(-1, 2) + 1
+        x1, y1 = topleft[:,0], topleft[:,1]
+        x2, y2 = botright[:,0], botright[:,1]
+        
+        empty = (x2 <= x1) | (y2 <= y1)
+        inside = (x1 >= 0) & (y1 >= 0) & (x2 <= self.size[0]) & (y2 <= self.size[1])
+        
+        #clip off-map corners so the lookups stay valid, those areas are rejected anyway
+        x1, x2 = numpy.clip(x1, 0, self.size[0]), numpy.clip(x2, 0, self.size[0])
+        y1, y2 = numpy.clip(y1, 0, self.size[1]), numpy.clip(y2, 0, self.size[1])
+        sat = self.blocked_counts()
+        blocked = sat[x2,y2] - sat[x1,y2] - sat[x2,y1] + sat[x1,y1]
+        return empty | (inside & (blocked == 0))
+        
+    def game_areas_clear(self, topleft, botright):
+        """Batch version of game_area_clear, taking (n,2) arrays of corners
+        in game coordinates."""
+        offset = numpy.array((self.size[0]*self.tilesize[0]/2, self.size[1]*self.tilesize[1]/2), numpy.float64)
+        tilesize = numpy.array(self.tilesize, numpy.float64)
+        corners = []
+        for coords in (topleft, botright):
+            coords = numpy.asarray(coords, numpy.float64).reshape(-1, 2)
+            corners.append(((coords + offset)/tilesize).astype(numpy.int64))
+        return self.map_areas_clear(corners[0], corners[1])
     
-    def game_area_clear(self, topleft, botright):
-        return self.map_area_clear( self.game_coords_to_map(topleft), self.game_coords_to_map(botright))
+    def _pathable_map(self, start, finish):
+        """Wraps the passability layer for pathfinding. Land cells at either
+        end stay walkable even if occupied, so paths can lead into and out of
+        structures."""
+        exempt = [tuple(p) for p in (start, finish)
+                  if 0 <= p[0] < self.size[0] and 0 <= p[1] < self.size[1] and self.terrain[p[0]][p[1]] != 0]
+        return PathableMap(self.passability(), exempt)
         
     def find_map_path(self, start, finish):
-        pmap = PathableMap(self.terrain)
+        pmap = self._pathable_map(start, finish)
         pather = path.PathFinder(start, finish, pmap)
         
         the_path = pather.find_path(True)
@@ -133,19 +635,7 @@ class Map(object):
         else:
             return the_path
 
-    def find_game_path(self, start, finish):        
-        base_path = self.find_map_path(self.game_coords_to_map(start), self.game_coords_to_map(finish))
-        if base_path is None:
-            return None
-        
-        final_path = [self.map_coords_to_game(p) for p in base_path]
-        final_path[0] = start
-        final_path[-1] = finish
-        
-        return final_path          
-        
     def reachable(self, start, finish):
-        pmap = PathableMap(self.terrain)
+        pmap = self._pathable_map(start, finish)
         pather = path.PathFinder(start, finish, pmap)        
         the_path = pather.find_path(False)
-        
\ No newline at end of file
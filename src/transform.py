@@ -1,6 +1,10 @@
 """Provides a caching image transformation class"""
 
 import pygame
+import time
+import numpy
+from collections import deque
+
 import autoloadcache
 
 _SMOOTHSCALE = 0
@@ -9,20 +13,98 @@ _ROTATE = 2
 _SCALE2X = 3
 _SCALE = 4
 _HALO = 5
+_ATLAS_SCALE = 6
 #_NUM_TRANSFORMS = 4
 
+_NAMES = {_SMOOTHSCALE: "smoothscale", _FLIP: "flip", _ROTATE: "rotate", _SCALE2X: "scale2x",
+          _SCALE: "scale", _HALO: "halo", _ATLAS_SCALE: "atlas_scale"}
+
+def surface_bytes(surface):
+    """Returns the size of the pixel data of the given surface in bytes.
+    Subsurfaces share their parent's pixels, so they count as 0."""
+    if surface.get_parent() is not None:
+        return 0
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
 class TransformCache(object):
-    """"Performs image transformations, cacheing the results for performance improvement"""
+    """"Performs image transformations, cacheing the results for performance improvement
+    
+    The cached surfaces are limited to budget bytes of pixel data, dropping
+    the least recently used ones first. Cut outs of scaled atlas pages share
+    the page's pixels, so the page carries their cost. It is touched after
+    each cut out, so it is only evicted once all its cut outs are.
+    """
 
-    def __init__(self):
-        self._cache = autoloadcache.AutoLoadCache( self)
+    #share of the cache budget that prefetched copies may fill
+    prefetch_share = 0.75
+
+    def __init__(self, budget=256*1024*1024):
+        self._cache = autoloadcache.AutoLoadCache( self, budget, surface_bytes, 
+                                                   lambda key: _NAMES[key[0]])
+        self._atlas_pages = set()
+        self._prefetch = deque()
         self.set_rotation_interval( 7)
         self._trans_func = {True: self._cache.get, False: self._cache_load}
 
+    def stats(self):
+        """Returns the cache hit, miss and eviction counts and its size in 
+        bytes, overall and per transformation."""
+        return self._cache.stats()
+        
     def set_rotation_interval(self, interval):
         """Sets the interval used for simplifying rotation angles"""
         self.rot_interval = interval
         
+    def add_atlas(self, atlas):
+        """Lets scale shrink images on the given atlas pages by scaling
+        their whole page once per scale factor."""
+        self._atlas_pages.update(atlas.pages)
+        
+    def prepare_scales(self, surfaces, scales):
+        """Builds the scaled copies of the given surfaces at each of the 
+        given scale factors ahead of use, so drawing at them never has to.
+        
+        Shrunk copies are made at once, which for images on an added atlas
+        costs one scale of each page per factor. Enlarged copies take far 
+        more memory and time, so they are queued for prefetch instead, 
+        smallest copy first. That spends the prefetch budget on as many 
+        copies as it holds across every factor, rather than on the lowest
+        factors alone.
+        """
+        enlarged = []
+        for scale in sorted(scales):
+            for surface in surfaces:
+                if scale < 1:
+                    self.scale(surface, scale)
+                elif scale > 1:
+                    enlarged.append((surface, scale))
+        enlarged.sort(key=lambda item: surface_bytes(item[0])*item[1]*item[1])
+        self._prefetch.extend(enlarged)
+                    
+    def prefetch(self, seconds):
+        """Builds queued scaled copies for up to the given time.
+        
+        Prefetching stops for good once the next copy would push the cache
+        past prefetch_share of its budget, as every copy after it is at 
+        least as large, leaving room for the transforms that are actually 
+        drawn rather than evicting them for copies that may never be.
+        
+        Returns:
+            True if there is still prefetching left to do.
+        """
+        end = time.time() + seconds
+        budget = self._cache.budget
+        if budget is not None:
+            budget *= self.prefetch_share
+        while self._prefetch and time.time() < end:
+            surface, scale = self._prefetch.popleft()
+            w, h = int(surface.get_width()*scale), int(surface.get_height()*scale)
+            if budget is not None and self._cache.size + w*h*surface.get_bytesize() > budget:
+                self._prefetch.clear()
+                break
+            self.scale(surface, (w, h))
+        return len(self._prefetch) > 0
+        
     def _cache_load(self, key):
         """Autoloader method for cacheing"""    
         if key[0] == _SMOOTHSCALE:
@@ -37,63 +119,68 @@ class TransformCache(object):
             return pygame.transform.scale( key[1], key[2])
         elif key[0] == _HALO:
             return self._do_halo( key[1], key[2], key[3])
+        elif key[0] == _ATLAS_SCALE:
+            return self._do_atlas_scale( key[1], key[2])
+            
+    def _do_atlas_scale(self, surface, scale):
+        """Transform function that cuts a scaled atlas image out of the scaled
+        copy of its page."""
+        page = self.scale( surface.get_parent(), scale)
+        x, y = surface.get_offset()
+        w, h = surface.get_size()
+        return page.subsurface( (int(x*scale), int(y*scale), int(w*scale), int(h*scale)))
             
     def _do_halo(self, surface, thickness, border_color):
-        """Transform function that creates a halo around the given image. Currently
-        has an issue where the halo is not rendered correctly around the corners of the
-        image. This could be solved by checking the alpha of the final image before setting
-        it, and refusing to put pixels of lesser alpha than what is already there."""
-    
-        newsurf = pygame.Surface((surface.get_width()+2*thickness, 
-                                    surface.get_height()+2*thickness), 
-                                    pygame.SRCALPHA)
-        newsurf.blit( surface, (thickness,thickness))
+        """Transform function that creates a halo around the given image.
+        
+        The halo is the mask of the image's opaque pixels dilated by a disc
+        of the given thickness, fading with distance from the image. It is 
+        composited under the image, so it never covers or weakens the 
+        image's own pixels, including around its corners."""
+        t = thickness
+        w, h = surface.get_size()
         a_thresh = 200
         
-        cols = []
-        for i in xrange(thickness):
-            alpha = int(a_thresh * (1-float(i)/thickness))
-            color = pygame.Color(border_color[0], border_color[1], border_color[2], alpha)
-            cols.append(color)
-        
-        for x in xrange(surface.get_width()):
-            #top border of halo
-            for y in xrange(surface.get_height()):
-                color = surface.get_at( (x,y))
-                if color.a > a_thresh:
-                    for i in range(thickness):
-                        newsurf.set_at((x+thickness,y+i), cols[thickness-i-1])
-                    break
-                    
-            #bottom border of halo
-            for y in xrange(surface.get_height()-1, -1, -1):
-                color = surface.get_at( (x,y))
-                if color.a > a_thresh:
-                    for i in range(thickness):
-                        newsurf.set_at((x+thickness,y+thickness+i+1), cols[i])
-                    break
-
-        for y in xrange(surface.get_height()):
-            #left border of halo
-            for x in xrange(surface.get_width()):
-                color = surface.get_at( (x,y))
-                if color.a > a_thresh:
-                    for i in range(thickness):
-                        newsurf.set_at((x+i,y+thickness), cols[thickness-i-1])
-                    break
-                    
-            #fight border of halo
-            for x in xrange(surface.get_width()-1, -1, -1):
-                color = surface.get_at( (x,y))
-                if color.a > a_thresh:
-                    for i in range(thickness):
-                        newsurf.set_at((x+thickness+i+1,y+thickness), cols[i])
-                    break
-
-                    
+        alpha = numpy.zeros((w+2*t, h+2*t), numpy.float32)
+        alpha[t:t+w, t:t+h] = pygame.surfarray.array_alpha(surface)
+        mask = alpha > a_thresh
+        alpha /= 255.0
+        
+        #distance from each pixel to the nearest opaque one, up to thickness:
+        #first along x, then combined over every y offset within reach
+        W, H = mask.shape
+        far = t+1
+        xdist = numpy.empty(mask.shape, numpy.float32)
+        xdist.fill(far)
+        for dx in xrange(t, -1, -1):
+            xdist[dx:][mask[:W-dx]] = dx
+            xdist[:W-dx][mask[dx:]] = dx
+        xdist *= xdist
+        dist = xdist.copy()
+        for dy in xrange(1, t+1):
+            numpy.minimum(dist[:, dy:], xdist[:, :H-dy] + dy*dy, dist[:, dy:])
+            numpy.minimum(dist[:, :H-dy], xdist[:, dy:] + dy*dy, dist[:, :H-dy])
+        dist = numpy.sqrt(dist)
+        
+        glow = a_thresh/255.0 * (1 - (dist-1)/t)
+        glow[(dist > t) | mask] = 0
+        
+        #the image over the halo
+        color = numpy.zeros((W, H, 3), numpy.float32)
+        color[t:t+w, t:t+h] = pygame.surfarray.array3d(surface)
+        under = glow * (1-alpha)
+        out_alpha = alpha + under
+        color = (color*alpha[...,None] + numpy.array(border_color[:3], numpy.float32)*under[...,None])
+        color /= numpy.maximum(out_alpha, 1e-6)[...,None]
+        
+        newsurf = pygame.Surface((W, H), pygame.SRCALPHA, 32)
+        pixels = pygame.surfarray.pixels3d(newsurf)
+        pixels[...] = numpy.clip(color+0.5, 0, 255)
+        del pixels
+        pixels = pygame.surfarray.pixels_alpha(newsurf)
+        pixels[...] = numpy.clip(out_alpha*255+0.5, 0, 255)
+        del pixels
         return newsurf
-    
-        #return pygame.transform.laplacian(surface)
             
     def smoothscale(self, surface, dim_or_scale, cached=True):
         """Performs a pygame smoothscale transformation"""
@@ -121,8 +208,19 @@ class TransformCache(object):
         return self._trans_func[cached]( (_SCALE2X, surface))
         
     def scale(self, surface, dim_or_scale, cached=True):
-        """Performs a pygame scale transformation"""
+        """Performs a pygame scale transformation
+        
+        Images on an added atlas that are shrunk by a scale factor are cut 
+        from a scaled copy of the whole atlas page. A cached scale by a 
+        factor of 1 returns the surface itself, an uncached one a copy.
+        """
         if not hasattr(dim_or_scale, "__getitem__"):
+            if cached and dim_or_scale == 1:
+                return surface
+            if cached and dim_or_scale < 1 and surface.get_parent() in self._atlas_pages:
+                cut = self._cache.get( (_ATLAS_SCALE, surface, dim_or_scale))
+                self.scale( surface.get_parent(), dim_or_scale)
+                return cut
             dim_or_scale = (int(surface.get_width()*dim_or_scale),
                             int(surface.get_height()*dim_or_scale))
         
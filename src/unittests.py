@@ -6,6 +6,26 @@ import actor
 from rungame import GameDirector
 import tech
 import path
+import tilemap
+import chunkmap
+import distance
+import placement
+import spatial
+import interface
+import atlas
+import transform
+import autoloadcache
+import textcache
+import viewport
+import observable
+import assetmanager
+import noise
+
+import numpy
+import pygame
+import os
+import tempfile
+import threading
 
 class ResourceStoreTest(unittest.TestCase):
     def setUp(self):
@@ -1089,6 +1109,988 @@ class PathTests(unittest.TestCase):
         self.assertEqual(simple_path, [(0,0), (3,0), (3,2)])
        
 
+class TileMapTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.map = tilemap.Map((12,10))
+        self.map.terrain[:] = numpy.random.randint(0, 3, (12,10))
+        
+    def test_grow_grass(self):
+        terrain = self.map.terrain.copy()
+        for x in xrange(12):
+            for y in xrange(10):
+                if terrain[x][y] == 2:
+                    for c in ((1,0),(-1,0),(0,1),(0,-1)):
+                        if self.map.terrain_equal((x+c[0],y+c[1]), 0):
+                            terrain[x][y] = 1
+                            
+        self.map.grow_grass()
+        self.assertTrue((self.map.terrain == terrain).all())
+        self.map.grow_grass()
+        self.assertTrue((self.map.terrain == terrain).all())
+        
+    def assertTilesCurrent(self):
+        for x in xrange(12):
+            for y in xrange(10):
+                self.assertEqual(self.map.get_tile_at((x,y)), self.map.compute_tile((x,y)))
+        
+    def test_compute_tiles(self):
+        self.map.compute_tiles()
+        self.assertTilesCurrent()
+        
+    def test_incremental_tiles(self):
+        self.map.compute_tiles()
+        seen = []
+        self.map.subscribe(seen.append)
+        
+        self.map.set_terrain_at((0,0), 1)
+        self.map.set_terrain_at((5,9), 1)
+        self.assertTilesCurrent()
+        self.assertEqual(seen, [(0,0,2,2), (4,8,3,2)])
+        
+        del seen[:]
+        self.map.set_terrain_rect((3,2), (6,4), 1)
+        self.assertTrue((self.map.terrain[3:7,2:5] == 1).all())
+        self.assertTilesCurrent()
+        self.assertEqual(seen, [(2,1,6,5)])
+        
+        del seen[:]
+        self.map.paint_terrain((11,0), 2, 0)
+        self.assertEqual(self.map.get_terrain_at((10,1)), 0)
+        self.assertEqual(self.map.get_terrain_at((9,0)), 0)
+        self.assertTilesCurrent()
+        self.assertEqual(seen, [(8,0,4,4)])
+        
+        self.map.grow_grass()
+        self.assertTilesCurrent()
+        
+    def test_change_notification(self):
+        self.map = tilemap.Map((40,20))
+        seen = []
+        self.map.subscribe(seen.append)
+        
+        version = self.map.region_version((0,0), (15,15))
+        far_version = self.map.region_version((32,16), (39,19))
+        self.map.set_terrain_at((3,3), 0)
+        self.assertEqual(seen, [(2,2,3,3)])
+        self.assertTrue(self.map.region_version((0,0), (15,15)) > version)
+        self.assertTrue(self.map.region_version((3,3), (3,3)) > version)
+        self.assertEqual(self.map.region_version((32,16), (39,19)), far_version)
+        self.assertEqual(self.map.region_version((0,0), (39,19)), self.map.version)
+        
+        self.map.terrain = numpy.ones((40,20), numpy.uint8)
+        self.map.set_terrain_at((20,10), 0)
+        del seen[:]
+        self.map.grow_grass()
+        self.map.grow_grass()
+        self.assertEqual(seen, [])
+        self.map.set_terrain_at((20,9), 2)
+        self.map.grow_grass()
+        self.assertEqual(seen[-1], (19,8,3,3))
+        
+        self.map.unsubscribe(seen.append)
+        self.map.set_terrain_at((0,0), 0)
+        self.assertEqual(len(seen), 2)
+        
+        fd, filepath = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            tilemap.Map((8,8)).save_binary(filepath)
+            self.map.subscribe(seen.append)
+            self.map.load_binary(filepath)
+            self.assertEqual(seen[-1], (0,0,8,8))
+            self.assertEqual(self.map.region_version((7,7), (7,7)), self.map.version)
+        finally:
+            del self.map
+            os.remove(filepath)
+        
+    def brute_area_clear(self, topleft, botright):
+        try:
+            for x in xrange(topleft[0], botright[0]+1):
+                for y in xrange(topleft[1], botright[1]+1):
+                    if x < 0 or y < 0 or self.map.terrain[x][y] == 0:
+                        return False
+            return True
+        except IndexError:
+            return False
+            
+    def test_area_clear(self):
+        self.map.compute_tiles()
+        self.map.set_terrain_rect((0,0), (11,9), 1)
+        self.map.set_terrain_at((4,5), 0)
+        self.map.paint_terrain((9,2), 1, 0)
+        
+        corners = [((x1,y1), (x2,y2)) for x1 in xrange(-1,13,3) for y1 in xrange(-1,11,2) 
+                                      for x2 in xrange(x1,14,2) for y2 in xrange(y1,12,3)]
+        for topleft, botright in corners:
+            self.assertEqual(self.map.map_area_clear(topleft, botright), self.brute_area_clear(topleft, botright))
+            
+        clear = self.map.map_areas_clear([c[0] for c in corners], [c[1] for c in corners])
+        self.assertEqual(list(clear), [self.brute_area_clear(*c) for c in corners])
+        
+        self.map.set_terrain_at((4,5), 2)
+        self.assertTrue(self.map.map_area_clear((0,3), (6,6)))
+        self.assertTrue(self.map.game_area_clear((-1200,-1000), (-1,-1)))
+        self.assertFalse(self.map.game_area_clear((0,-1000), (1200,-1)))
+        self.assertEqual(list(self.map.game_areas_clear([(-1200,-1000), (0,-1000)], [(-1,-1), (1200,-1)])), [True, False])
+        
+    def test_layers(self):
+        self.map.compute_tiles()
+        self.assertEqual(self.map.terrain.dtype, numpy.uint8)
+        self.assertEqual(self.map.tiles.dtype, numpy.uint8)
+        self.assertTrue((self.map.passability() == (self.map.terrain != 0)).all())
+        
+        self.map.set_terrain_rect((0,0), (2,2), 0)
+        self.map.set_terrain_at((1,1), 2)
+        self.assertFalse(self.map.passability()[0][0])
+        self.assertTrue(self.map.passability()[1][1])
+        
+        usage = self.map.memory_usage()
+        self.assertEqual(usage['terrain'], 120)
+        self.assertEqual(usage['tiles'], 120)
+        self.assertEqual(usage['occupancy'], 120)
+        self.assertEqual(usage['passable'], 120)
+        
+        self.assertRaises(ValueError, self.map.layers.set, 'terrain', numpy.zeros((3,3)))
+        
+    def assertDistancesCurrent(self, terrain_type):
+        terrain = self.map.terrain
+        if terrain_type == distance.LAND:
+            targets = zip(*numpy.nonzero(terrain != 0))
+        else:
+            targets = zip(*numpy.nonzero(terrain == terrain_type))
+        field = self.map.distance_field()
+        for x in xrange(12):
+            for y in xrange(10):
+                best = min([abs(x-u)+abs(y-v) for u, v in targets] or [None])
+                self.assertEqual(field.distance((x,y), terrain_type), best)
+                nearest = field.nearest((x,y), terrain_type)
+                if best is not None:
+                    self.assertEqual(abs(x-nearest[0])+abs(y-nearest[1]), best)
+                    self.assertTrue(nearest in targets)
+                    
+    def test_distance_field(self):
+        self.map.compute_tiles()
+        for terrain_type in (0, 1, 2, distance.LAND):
+            self.assertDistancesCurrent(terrain_type)
+            
+        self.map.set_terrain_at((3,3), 0)
+        self.map.set_terrain_at((9,1), 1)
+        self.map.set_terrain_rect((0,6), (4,9), 2)
+        for terrain_type in (0, 1, 2, distance.LAND):
+            self.assertDistancesCurrent(terrain_type)
+            
+        self.map.set_terrain_rect((0,0), (11,9), 2)
+        self.assertEqual(self.map.nearest_terrain((5,5), 0), None)
+        self.map.set_terrain_at((2,2), 0)
+        self.assertEqual(self.map.nearest_terrain((5,5), 0), (2,2))
+        self.assertEqual(self.map.distance_to_shore((5,5)), 6)
+        self.assertEqual(self.map.distance_to_shore((2,2)), 1)
+        
+    def test_binary_save_load(self):
+        self.map.compute_tiles()
+        fd, filepath = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.map.save_binary(filepath)
+            loaded = tilemap.Map((1,1), filepath=filepath)
+            self.assertEqual(loaded.size, (12,10))
+            self.assertTrue((loaded.terrain == self.map.terrain).all())
+            self.assertTrue((loaded.tiles == self.map.tiles).all())
+            
+            #edits stay in memory, the file is left untouched
+            loaded.set_terrain_at((2,2), 0)
+            again = tilemap.Map((1,1), filepath=filepath)
+            self.assertEqual(again.get_terrain_at((2,2)), self.map.get_terrain_at((2,2)))
+            del loaded, again
+            
+            #a file cut short is refused before the map is touched
+            with open(filepath, "rb") as f:
+                data = f.read()
+            with open(filepath, "wb") as f:
+                f.write(data[:-1])
+            other = tilemap.Map((8,8))
+            terrain = other.terrain.copy()
+            self.assertRaises(tilemap.MapFormatError, other.load_binary, filepath)
+            self.assertEqual(other.size, (8,8))
+            self.assertTrue((other.terrain == terrain).all())
+            
+            with open(filepath, "wb") as f:
+                f.write("not a map")
+            self.assertRaises(tilemap.MapFormatError, tilemap.Map, (1,1), filepath=filepath)
+        finally:
+            os.remove(filepath)
+
+
+class ChunkedMapTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.map = chunkmap.ChunkedMap((50,40), seed=1234, chunk_size=16, max_resident=4)
+        
+    def tearDown(self):
+        self.map.close()
+        
+    def test_matches_whole_world(self):
+        gen = noise.LayeredLatticeNoise2D(1234, tilemap.FEATURE_SIZE, tilemap.NOISE_LAYERS, tilemap.NOISE_FALLOFF)
+        xs, ys = numpy.mgrid[0:50, 0:40]
+        terrain = tilemap.classify_terrain(gen.values(xs, ys))
+        terrain[(terrain == 2) & tilemap.bordering(terrain == 0)] = 1
+        grass = numpy.zeros((52,42), bool)
+        grass[1:-1,1:-1] = terrain == 1
+        tiles = tilemap.transition_tiles(grass, tilemap.BaseMap.coords)
+        
+        self.assertEqual(self.map.resident_chunks(), [])
+        self.assertTrue((self.map.get_terrain_region((0,0), (49,39)) == terrain).all())
+        for x in xrange(50):
+            for y in xrange(40):
+                self.assertEqual(self.map.get_tile_at((x,y)), tiles[x][y])
+        self.assertTrue(len(self.map.resident_chunks()) <= 4)
+        
+    def test_detour(self):
+        for x in xrange(30):
+            for y in xrange(40):
+                self.map.set_terrain_at((x,y), 0 if x == 20 and y < 39 else 1)
+        the_path = self.map.find_map_path((18,0), (22,0), 2)
+        self.assertEqual(the_path[0], (18,0))
+        self.assertEqual(the_path[-1], (22,0))
+        self.assertEqual(max(p[1] for p in the_path), 39)
+        self.map.set_terrain_at((20,39), 0)
+        self.assertEqual(self.map.find_map_path((18,0), (22,0), 2), None)
+        
+    def test_edits_survive_eviction(self):
+        self.map.set_terrain_at((16,16), 0)
+        self.map.set_terrain_at((15,15), 1)
+        tile = self.map.get_tile_at((16,16))
+        self.assertEqual(tile, self.map.compute_tile((16,16)))
+        self.assertEqual(self.map.get_tile_at((14,14)), self.map.compute_tile((14,14)))
+        
+        self.map.touch_region((32,0), (49,39))
+        self.assertFalse((1,1) in self.map.resident_chunks())
+        self.assertEqual(self.map.get_terrain_at((16,16)), 0)
+        self.assertEqual(self.map.get_terrain_at((15,15)), 1)
+        self.assertEqual(self.map.get_tile_at((16,16)), tile)
+        
+    def test_matches_map(self):
+        world = tilemap.Map((50,40), seed=1234)
+        self.assertTrue((self.map.get_terrain_region((0,0), (49,39)) == world.terrain).all())
+        
+    def test_worker_count(self):
+        terrain, tiles = tilemap.generate_world((70,90), 99, chunk_size=16)
+        terrain2, tiles2 = tilemap.generate_world((70,90), 99, chunk_size=16, workers=3)
+        self.assertTrue((terrain == terrain2).all())
+        self.assertTrue((tiles == tiles2).all())
+        terrain3, tiles3 = tilemap.generate_world((70,90), 100, chunk_size=16)
+        self.assertFalse((terrain == terrain3).all())
+        
+    def test_bounds(self):
+        self.assertRaises(IndexError, self.map.get_terrain_at, (50,0))
+        self.assertRaises(IndexError, self.map.get_terrain_at, (0,-1))
+        self.assertFalse(self.map.map_area_clear((45,0), (50,3)))
+
+
+class PlacementTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.game = game.Game()
+        self.game.map = tilemap.Map((12,10), (100,100))
+        self.game.map.terrain = numpy.ones((12,10), numpy.uint8)
+        self.game.map.set_terrain_rect((0,0), (2,9), 0)
+        self.placement = placement.PlacementMap(self.game)
+        
+    def add_structure(self, tile, reservoir=False):
+        obj = game.StructureObject(self.game, (50,50), self.game.map.map_coords_to_game(tile), 0)
+        if reservoir:
+            obj.set_reservoir(5, 'stone', 0)
+        self.game.add_game_object(obj)
+        return obj
+        
+    def test_suitability(self):
+        self.add_structure((6,2), True)
+        self.add_structure((9,7))
+        for footprint in ((1,1), (2,3), (4,2)):
+            grid = self.placement.suitability(footprint)
+            for x in xrange(12):
+                for y in xrange(10):
+                    u, v = x+footprint[0]-1, y+footprint[1]-1
+                    covers = lambda site: x <= site[0] <= u and y <= site[1] <= v
+                    clear = self.game.map.map_area_clear((x,y), (u,v)) and not covers((6,2)) and not covers((9,7))
+                    if not clear:
+                        self.assertEqual(grid[x][y], 0)
+                    else:
+                        cx, cy = x+footprint[0]//2, y+footprint[1]//2
+                        self.assertAlmostEqual(grid[x][y], 1.0/(1+abs(cx-6)+abs(cy-2)), 5)
+                        
+        self.assertEqual(self.placement.best_site((2,2)), (4,1))
+        
+    def test_invalidation(self):
+        self.assertTrue(self.placement.site_suitable((4,4), (5,5)))
+        self.assertFalse(self.placement.site_suitable((2,4), (3,5)))
+        self.assertFalse(self.placement.site_suitable((11,4), (12,5)))
+        
+        obj = self.add_structure((5,5))
+        self.assertFalse(self.placement.site_suitable((4,4), (5,5)))
+        obj.finished = True
+        self.game.update()
+        self.assertTrue(self.placement.site_suitable((4,4), (5,5)))
+        
+        self.game.map.set_terrain_at((4,5), 0)
+        self.assertFalse(self.placement.site_suitable((4,4), (5,5)))
+        self.assertEqual(self.placement.best_site((20,20)), None)
+        
+    def test_reservoir_invalidation(self):
+        before = self.placement.suitability((1,1))[8][8]
+        version = self.game.structure_version
+        self.add_structure((5,5), True)
+        self.assertTrue(self.game.structure_version > version)
+        self.assertNotAlmostEqual(before, 1.0/7, 5)
+        self.assertAlmostEqual(self.placement.suitability((1,1))[8][8], 1.0/7, 5)
+        
+class OccupancyTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.game = game.Game()
+        self.game.map = tilemap.Map((8,8), (100,100))
+        self.game.map.terrain = numpy.ones((8,8), numpy.uint8)
+        
+    def add_structure(self, tile):
+        obj = game.StructureObject(self.game, (50,50), self.game.map.map_coords_to_game(tile), 0)
+        self.game.add_game_object(obj)
+        return obj
+        
+    def test_occupancy(self):
+        m = self.game.map
+        self.assertTrue(m.map_area_clear((2,2), (4,4)))
+        a = self.add_structure((3,3))
+        b = self.add_structure((3,3))
+        self.assertEqual(m.layers.occupancy[3][3], 2)
+        self.assertEqual(m.layers.occupancy.sum(), 2)
+        self.assertFalse(m.passability()[3][3])
+        self.assertFalse(m.map_area_clear((2,2), (4,4)))
+        self.assertTrue(m.map_area_clear((4,2), (5,5)))
+        
+        a.finished = True
+        self.game.update()
+        self.assertFalse(m.map_area_clear((2,2), (4,4)))
+        self.game.remove_game_object(b)
+        self.assertTrue(m.map_area_clear((2,2), (4,4)))
+        self.assertTrue(m.passability().all())
+        
+        self.add_structure((5,5))
+        self.game.map = tilemap.Map((8,8), (100,100))
+        self.assertEqual(self.game.map.layers.occupancy[5][5], 1)
+        self.assertEqual(m.layers.occupancy[5][5], 0)
+        
+    def test_count_limits(self):
+        m = self.game.map
+        rect = pygame.Rect(m.map_coords_to_game((3,3)), (10,10))
+        m.remove_occupant(rect)
+        self.assertEqual(m.layers.occupancy[3][3], 0)
+        for i in xrange(300):
+            m.add_occupant(rect)
+        self.assertEqual(m.layers.occupancy[3][3], 255)
+        self.assertFalse(m.passability()[3][3])
+        
+    def test_load_map(self):
+        self.add_structure((2,2))
+        fd, filepath = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            tilemap.Map((8,8), (100,100)).save_binary(filepath)
+            self.game.load_map(filepath)
+            self.assertEqual(self.game.map.layers.occupancy[2][2], 1)
+            self.assertEqual(self.game.map.layers.occupancy.sum(), 1)
+            self.assertFalse(self.game.map.passability()[2][2])
+            
+            self.game.map.load_binary(filepath)
+            self.assertEqual(self.game.map.layers.occupancy.sum(), 0)
+        finally:
+            del self.game
+            os.remove(filepath)
+        
+    def test_pathing(self):
+        m = self.game.map
+        for y in xrange(7):
+            self.add_structure((4,y))
+        the_path = m.find_map_path((2,0), (6,0))
+        self.assertEqual(the_path[0], (2,0))
+        self.assertEqual(the_path[-1], (6,0))
+        self.assertTrue(max(p[1] for p in the_path) == 7)
+        self.assertEqual(m.find_map_path((2,0), (4,0))[-1], (4,0))
+        self.assertEqual(m.find_map_path((4,0), (2,0))[-1], (2,0))
+        m.set_terrain_at((4,7), 0)
+        self.assertEqual(m.find_map_path((2,0), (6,0)), None)
+        
+class SpatialGridTests(unittest.TestCase):
+    
+    def test_query(self):
+        grid = spatial.SpatialGrid(100)
+        grid.insert('a', (10,10,20,20))
+        grid.insert('b', (150,-50,100,300))
+        grid.insert('c', (-500,-500,50,50))
+        self.assertEqual(len(grid), 3)
+        self.assertEqual(grid.query((0,0,200,200)), set(['a','b']))
+        self.assertEqual(grid.query((25,25,200,10)), set(['a','b']))
+        self.assertEqual(grid.query((30,30,100,100)), set())
+        self.assertEqual(grid.query((-1000,-1000,2000,2000)), set(['a','b','c']))
+        self.assertEqual(grid.query((10,10,0,0)), set())
+        self.assertEqual(grid.query_point((15,15)), set(['a']))
+        self.assertEqual(grid.query_point((30,30)), set())
+        self.assertEqual(grid.query_point((-480,-480)), set(['c']))
+        
+    def test_move_remove(self):
+        grid = spatial.SpatialGrid(100)
+        grid.insert('a', (10,10,20,20))
+        grid.insert('a', (20,20,20,20))
+        self.assertEqual(grid.get_rect('a'), (20,20,20,20))
+        grid.insert('a', (410,410,20,20))
+        self.assertEqual(len(grid), 1)
+        self.assertEqual(grid.query((0,0,100,100)), set())
+        self.assertEqual(grid.query_point((420,420)), set(['a']))
+        
+        grid.remove('a')
+        self.assertFalse('a' in grid)
+        self.assertEqual(grid.query((0,0,1000,1000)), set())
+        self.assertRaises(KeyError, grid.remove, 'a')
+        grid.discard('a')
+        
+class MockLayeredWidget(object):
+    def __init__(self, layer, bottom):
+        self.layer = layer
+        self._space_rect = pygame.Rect(0, bottom-10, 10, 10)
+        
+class LayeredOrderTests(unittest.TestCase):
+    
+    def test_order(self):
+        order = interface.LayeredOrder()
+        a = MockLayeredWidget(10, 50)
+        b = MockLayeredWidget(10, 20)
+        c = MockLayeredWidget(5, 100)
+        d = MockLayeredWidget(10, 50)
+        for w in (a, b, c, d):
+            order.refresh(w)
+        self.assertEqual(list(order), [c, b, a, d])
+        
+        b._space_rect.bottom = 60
+        order.refresh(b)
+        self.assertEqual(list(order), [c, a, d, b])
+        a._space_rect.bottom = 55
+        order.refresh(a)
+        order.refresh(d)
+        self.assertEqual(list(order), [c, d, a, b])
+        
+        order.remove(d)
+        self.assertFalse(d in order)
+        self.assertEqual(list(order), [c, a, b])
+        self.assertRaises(KeyError, order.remove, d)
+        order.discard(d)
+        self.assertEqual(len(order), 3)
+        
+class CullingTests(unittest.TestCase):
+    
+    def setUp(self):
+        pygame.display.init()
+        pygame.font.init()
+        self.game = game.Game()
+        self.iface = interface.InterfaceManager(None)
+        self.vp = viewport.Viewport(pygame.Surface((200,200)))
+        self.obj = game.GameObject(self.game, (20,20), (100,100))
+        self.game.add_game_object(self.obj)
+        self.widget = interface.GameObjWidget(self.iface, self.obj)
+        self.iface.add_child(self.widget)
+        self.iface.update(self.vp)
+        
+    def test_moved_only(self):
+        self.assertEqual(self.iface._visible, [self.widget])
+        self.obj.position = (5000, 100)
+        self.assertEqual(self.iface._world_moved, set([self.widget]))
+        self.iface.update(self.vp)
+        self.assertEqual(self.iface._visible, [])
+        self.assertEqual(self.iface._world_moved, set())
+        
+        #culled widgets are left where they were until they come back
+        self.obj.position = (6000, 100)
+        self.iface.update(self.vp)
+        self.assertEqual(self.widget._space_rect.center, (100,100))
+        self.obj.position = (120, 100)
+        self.iface.update(self.vp)
+        self.assertEqual(self.iface._visible, [self.widget])
+        self.assertEqual(self.widget._space_rect.center, (120,100))
+        
+    def test_finished(self):
+        self.obj.finished = True
+        self.game.update()
+        self.iface.update(self.vp)
+        self.assertEqual(self.iface._children, [])
+        self.assertFalse(self.widget in self.iface._world_index)
+        
+class AtlasTests(unittest.TestCase):
+    
+    def make_image(self, size, color):
+        img = pygame.Surface(size, pygame.SRCALPHA, 32)
+        img.fill(color)
+        img.set_at((0,0), (0,0,0,0))
+        return img
+        
+    def test_pack(self):
+        images = {}
+        for i in xrange(20):
+            images['img%d'%i] = self.make_image((30+i, 20+2*i), (i*10, 255-i*10, 100, 200))
+        images['big'] = self.make_image((300,10), (1,2,3,255))
+        images['rgb'] = pygame.Surface((10,10), 0, 24)
+        
+        at = atlas.SpriteAtlas((128,128), 16)
+        packed = at.pack(images)
+        self.assertEqual(len(packed), 20)
+        self.assertFalse('big' in at)
+        self.assertFalse('rgb' in at)
+        self.assertTrue(len(at.pages) > 1)
+        
+        rects = []
+        for tag, sub in packed.iteritems():
+            self.assertTrue(sub.get_parent() in at.pages)
+            self.assertEqual(sub.get_size(), images[tag].get_size())
+            self.assertEqual(sub.get_offset()[0] % 16, 0)
+            self.assertEqual(sub.get_offset()[1] % 16, 0)
+            self.assertEqual(tuple(sub.get_at((0,0))), (0,0,0,0))
+            self.assertEqual(sub.get_at((5,7)), images[tag].get_at((5,7)))
+            rects.append((at.pages.index(sub.get_parent()), pygame.Rect(sub.get_offset(), sub.get_size())))
+        for i, (page, rect) in enumerate(rects):
+            for page2, rect2 in rects[i+1:]:
+                self.assertFalse(page == page2 and rect.colliderect(rect2))
+                
+    def test_scaled_page(self):
+        images = {'a': self.make_image((40,24), (255,0,0,255)),
+                  'b': self.make_image((33,17), (0,255,0,255))}
+        at = atlas.SpriteAtlas((128,128), 16)
+        packed = at.pack(images)
+        cache = transform.TransformCache()
+        cache.add_atlas(at)
+        for tag, sub in packed.iteritems():
+            for scale in (0.5, 0.25, 1, 2):
+                scaled = cache.scale(sub, scale)
+                self.assertEqual(scaled.get_size(), cache.scale(images[tag], scale).get_size())
+                self.assertTrue(scaled is cache.scale(sub, scale))
+            half = cache.scale(sub, 0.5)
+            self.assertTrue(half.get_parent() is cache.scale(sub.get_parent(), 0.5))
+            self.assertEqual(half.get_at((3,3)), images[tag].get_at((6,6)))
+            
+    def test_page_cost(self):
+        images = dict(('img%d'%i, self.make_image((20+i, 10+i), (i*20, 0, 0, 255))) for i in xrange(8))
+        at = atlas.SpriteAtlas((64,64), 16)
+        packed = at.pack(images)
+        self.assertTrue(len(at.pages) > 1)
+        cache = transform.TransformCache()
+        cache.add_atlas(at)
+        for scale in (0.5, 0.25):
+            for sub in packed.itervalues():
+                cache.scale(sub, scale)
+        page_bytes = sum(transform.surface_bytes(cache.scale(page, scale))
+                         for page in at.pages for scale in (0.5, 0.25))
+        stats = cache.stats()
+        self.assertEqual(stats['bytes'], page_bytes)
+        self.assertEqual(stats['categories']['atlas_scale']['bytes'], 0)
+        
+        #with room for one scaled page, cut outs never outlive theirs
+        cache = transform.TransformCache(transform.surface_bytes(cache.scale(at.pages[0], 0.5)))
+        cache.add_atlas(at)
+        for sub in packed.itervalues():
+            cache.scale(sub, 0.5)
+            keys = cache._cache._cache.keys()
+            pages = [key[1] for key in keys if key[0] == transform._SCALE]
+            for key in keys:
+                if key[0] == transform._ATLAS_SCALE:
+                    self.assertTrue(key[1].get_parent() in pages)
+        
+class MockCacheLoader(object):
+    def __init__(self):
+        self.loads = 0
+        
+    def _cache_load(self, key):
+        self.loads += 1
+        return key[0] * key[1]
+        
+class AutoLoadCacheTests(unittest.TestCase):
+    
+    def test_lru(self):
+        loader = MockCacheLoader()
+        cache = autoloadcache.AutoLoadCache(loader, 10, len, lambda key: key[0])
+        self.assertEqual(cache.get(('a',4)), 'aaaa')
+        self.assertEqual(cache.get(('b',4)), 'bbbb')
+        self.assertEqual(cache.get(('a',4)), 'aaaa')
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(loader.loads, 2)
+        
+        #'b' is the least recently used
+        cache.get(('c',2))
+        cache.get(('a',1))
+        self.assertFalse(('b',4) in cache)
+        self.assertTrue(('a',4) in cache)
+        self.assertEqual(cache.size, 7)
+        
+        cache.get(('d',20))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 20)
+        
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 5, 4))
+        self.assertEqual(stats['categories']['a'], {'hits': 1, 'misses': 2, 'evictions': 2, 'entries': 0, 'bytes': 0})
+        self.assertEqual(stats['categories']['d']['bytes'], 20)
+        
+        cache.remove(('d',20))
+        self.assertEqual(cache.size, 0)
+        self.assertRaises(KeyError, cache.remove, ('d',20))
+        
+    def test_unbounded(self):
+        cache = autoloadcache.AutoLoadCache(MockCacheLoader())
+        for i in xrange(100):
+            cache.get(('x', i))
+        self.assertEqual(len(cache), 100)
+        self.assertEqual(cache.stats()['evictions'], 0)
+        
+    def test_prepare_scales(self):
+        cache = transform.TransformCache(budget=30000)
+        cache.prefetch_share = 1.0
+        imgs = [pygame.Surface((20,20), pygame.SRCALPHA, 32) for i in xrange(2)]
+        small = pygame.Surface((5,5), pygame.SRCALPHA, 32)
+        cache.prepare_scales(imgs + [small], [0.5, 1, 2, 4])
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertTrue(cache.scale(imgs[0], 1) is imgs[0])
+        self.assertFalse(cache.scale(imgs[0], 1, False) is imgs[0])
+        
+        self.assertFalse(cache.prefetch(10))
+        self.assertEqual(cache.stats()['misses'], 7)
+        cache.scale(imgs[1], 2)
+        cache.scale(small, 4)
+        self.assertEqual(cache.stats()['misses'], 7)
+        
+        #the 4x copies of the larger images would not fit in the budget
+        self.assertEqual(cache.stats()['evictions'], 0)
+        cache.scale(imgs[1], 4)
+        self.assertEqual(cache.stats()['misses'], 8)
+        
+    def test_halo(self):
+        img = pygame.Surface((10,10), pygame.SRCALPHA, 32)
+        img.fill((10,20,30,255), (2,2,6,6))
+        img.set_at((1,4), (10,20,30,240))
+        img.set_at((8,4), (10,20,30,100))
+        halo = transform.TransformCache().halo(img, 3, (255,0,0))
+        self.assertEqual(halo.get_size(), (16,16))
+        
+        #the image itself is untouched, its edge pixels are never weakened
+        self.assertEqual(tuple(halo.get_at((6,6))), (10,20,30,255))
+        self.assertEqual(tuple(halo.get_at((4,7))), (10,20,30,240))
+        self.assertTrue(halo.get_at((11,7)).a > 100)
+        
+        #the halo fades out with distance, corners included
+        above = [halo.get_at((8,y)).a for y in (4,3,2,1)]
+        self.assertEqual(above[0], 200)
+        self.assertTrue(above[0] > above[1] > above[2] > 0)
+        self.assertEqual(above[3], 0)
+        self.assertEqual(tuple(halo.get_at((4,4)))[:3], (255,0,0))
+        self.assertTrue(halo.get_at((4,4)).a > 0)
+        self.assertEqual(halo.get_at((0,0)).a, 0)
+        
+    def test_transform_budget(self):
+        cache = transform.TransformCache(budget=3*100*100*4)
+        img = pygame.Surface((50,50), pygame.SRCALPHA, 32)
+        for size in (100, 101, 102, 103):
+            cache.scale(img, (size, 100))
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['categories']['scale']['evictions'], 2)
+        self.assertTrue(stats['bytes'] <= 3*100*100*4)
+        
+class TextCacheTests(unittest.TestCase):
+    
+    def setUp(self):
+        pygame.font.init()
+        self.font = pygame.font.Font(None, 22)
+        self.cache = textcache.TextCache()
+        
+    def test_cached(self):
+        img = self.cache.render(self.font, "Research", (0,0,0))
+        self.assertEqual(img.get_size(), self.font.size("Research"))
+        self.assertTrue(img is self.cache.render(self.font, "Research", (0,0,0)))
+        self.assertFalse(img is self.cache.render(self.font, "Research", (255,255,0)))
+        self.assertFalse(img is self.cache.render(pygame.font.Font(None, 16), "Research", (0,0,0)))
+        
+    def test_numbers(self):
+        self.assertEqual(self.cache._runs("Spirit: 12.5 of 3"), ["Spirit: ", "1", "2", ".", "5", " of ", "3"])
+        self.assertEqual(self.cache._runs("42"), ["4", "2"])
+        
+        img = self.cache.render(self.font, "Foodbuffer: 15", (0,0,0))
+        self.assertEqual(img.get_height(), self.font.get_height())
+        self.assertTrue(abs(img.get_width() - self.font.size("Foodbuffer: 15")[0]) <= 2)
+        word = self.cache.render(self.font, "Foodbuffer: ", (0,0,0))
+        self.assertEqual(img.get_at((word.get_width()//2, 8)), word.get_at((word.get_width()//2, 8)))
+        
+        #a new count reuses the glyphs and the words around them
+        misses = self.cache.stats()['misses']
+        self.cache.render(self.font, "Foodbuffer: 51", (0,0,0))
+        self.assertEqual(self.cache.stats()['misses'], misses+1)
+        
+class MockObserver(object):
+    def __init__(self, source):
+        self.seen = []
+        source.subscribe(self.changed)
+        
+    def changed(self, source):
+        self.seen.append(source)
+        
+class ObservableTests(unittest.TestCase):
+    
+    def test_notify(self):
+        source = observable.Observable()
+        seen = []
+        source.subscribe(seen.append)
+        observer = MockObserver(source)
+        source.notify()
+        self.assertEqual(seen, [source])
+        self.assertEqual(observer.seen, [source])
+        
+        source.unsubscribe(observer.changed)
+        source.unsubscribe(seen.append)
+        source.notify()
+        self.assertEqual(len(seen)+len(observer.seen), 2)
+        
+    def test_weak_observers(self):
+        source = observable.Observable()
+        observer = MockObserver(source)
+        del observer
+        source.notify()
+        self.assertEqual(source._observers(), [])
+        
+    def test_store(self):
+        store1 = resource.ResourceStore(None, 10, ['stone'], resource.ResourceStore.WAREHOUSE)
+        store2 = resource.ResourceStore(None, 10, ['wood'], resource.ResourceStore.WAREHOUSE)
+        comp = resource.CompositeResourceStore(None, (store1, store2))
+        observer = MockObserver(comp)
+        
+        comp.deposit( {'type':'wood', 'qty':4})
+        self.assertEqual(len(observer.seen), 1)
+        res = comp.reserve_resources('wood', 2)
+        self.assertEqual(len(observer.seen), 2)
+        comp.update()
+        self.assertEqual(len(observer.seen), 2)
+        res.release()
+        comp.update()
+        self.assertEqual(len(observer.seen), 3)
+        
+    def test_bound_text(self):
+        store = resource.ResourceStore(None, 10, ['stone'], resource.ResourceStore.WAREHOUSE)
+        calls = []
+        def contents():
+            calls.append(1)
+            return store.get_actual_contents('stone')
+        gen = interface.BoundTextGenerator(store, contents)
+        self.assertEqual(gen.get_text(), "0")
+        self.assertFalse(gen.text_changed())
+        self.assertEqual(len(calls), 1)
+        
+        store.deposit( {'type':'stone', 'qty':3})
+        store.deposit( {'type':'stone', 'qty':2})
+        self.assertTrue(gen.text_changed())
+        self.assertEqual(gen.get_text(), "5")
+        self.assertFalse(gen.text_changed())
+        self.assertEqual(len(calls), 2)
+        
+    def test_actor(self):
+        a = actor.Actor(game.Game(), (0,0))
+        observer = MockObserver(a)
+        a.set_order(MockStatefulOrder1(a))
+        self.assertEqual(len(observer.seen), 2)
+        a.carrying = {'type':'stone', 'qty':1}
+        self.assertEqual(len(observer.seen), 3)
+        
+class MockBlockingLoader(object):
+    def __init__(self):
+        self.release = threading.Event()
+        
+    def load(self, path):
+        self.release.wait()
+        return pygame.Surface((len(os.path.basename(path)), 2))
+        
+class MockBlockingBundleLoader(object):
+    def __init__(self):
+        self.release = threading.Event()
+        
+    def load(self, source):
+        self.release.wait()
+        return assetmanager.ImageLoader().load(source)
+        
+class AssetManagerTests(unittest.TestCase):
+    
+    def setUp(self):
+        fd, self.filepath = tempfile.mkstemp()
+        os.write(fd, "image a a.png\nimage bb bb.png\n")
+        os.close(fd)
+        self.assets = assetmanager.AssetManager()
+        self.loader = MockBlockingLoader()
+        self.assets.add_asset_loader("image", self.loader)
+        
+    def tearDown(self):
+        self.loader.release.set()
+        self.assets.wait()
+        os.remove(self.filepath)
+        
+    def test_background(self):
+        self.assets.load_set(self.filepath, 2)
+        self.assertEqual(self.assets.progress(), 0.0)
+        self.assertTrue(self.assets.get("a") is self.assets.placeholder)
+        
+        self.loader.release.set()
+        self.assets.wait()
+        self.assertEqual(self.assets.progress(), 1.0)
+        self.assertEqual(self.assets.get("a").get_size(), (5,2))
+        self.assertEqual(self.assets.get("bb").get_size(), (6,2))
+        
+    def test_lazy(self):
+        self.loader.release.set()
+        self.assets.load_set(self.filepath)
+        self.assertEqual(self.assets.progress(), 1.0)
+        self.assertEqual(self.assets.get("a").get_size(), (5,2))
+        
+class AssetBundleTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.set_path = os.path.join(self.dir, "assets.txt")
+        self.bundle_path = os.path.join(self.dir, "assets.bundle")
+        img = pygame.Surface((3,5), pygame.SRCALPHA, 32)
+        img.fill((10,20,30,40))
+        pygame.image.save(img, os.path.join(self.dir, "a.png"))
+        pygame.image.save(pygame.Surface((7,2)), os.path.join(self.dir, "b.bmp"))
+        f = open(self.set_path, "w")
+        f.write("image a a.png\nimage b b.bmp\nimage gone gone.png\n")
+        f.close()
+        
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+        
+    def test_round_trip(self):
+        self.assertTrue(assetmanager.bundle_outdated(self.set_path, self.bundle_path))
+        assetmanager.build_bundle(self.set_path, self.bundle_path)
+        self.assertFalse(assetmanager.bundle_outdated(self.set_path, self.bundle_path))
+        
+        assets = assetmanager.AssetManager()
+        assets.load_bundle(self.bundle_path)
+        self.assertEqual(assets.get("a").get_size(), (3,5))
+        self.assertEqual(tuple(assets.get("a").get_at((1,1))), (10,20,30,40))
+        self.assertEqual(assets.get("b").get_size(), (7,2))
+        self.assertEqual(sorted(assets.get_images()), ["a", "b"])
+        
+    def test_background(self):
+        assetmanager.build_bundle(self.set_path, self.bundle_path)
+        assets = assetmanager.AssetManager()
+        loader = MockBlockingBundleLoader()
+        assets.add_asset_loader("image", loader)
+        assets.load_bundle(self.bundle_path, 2)
+        try:
+            self.assertEqual(assets.get("a").get_size(), (3,5))
+            self.assertTrue(assets.get("gone") is assets.placeholder)
+        finally:
+            loader.release.set()
+            assets.wait()
+        
+        #every asset is loaded, so the mapping is no longer held
+        self.assertEqual(assets._bundles, [])
+        self.assertEqual(assets.get("b").get_size(), (7,2))
+        
+    def test_not_bundle(self):
+        self.assertRaises(assetmanager.AssetException, assetmanager.AssetManager().load_bundle, self.set_path)
+        
+class PixelCacheTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, "cache")
+        self.path = os.path.join(self.dir, "a.png")
+        self.img = pygame.Surface((4,3), pygame.SRCALPHA, 32)
+        self.img.fill((10,20,30,40))
+        pygame.image.save(self.img, self.path)
+        self.loader = assetmanager.ImageLoader(self.cache_dir)
+        
+    def tearDown(self):
+        for root, dirs, files in os.walk(self.dir, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+            for name in dirs:
+                os.rmdir(os.path.join(root, name))
+        os.rmdir(self.dir)
+        
+    def test_warm_load(self):
+        cold = self.loader.load(self.path)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        warm = self.loader.load(self.path)
+        self.assertEqual(warm.get_size(), (4,3))
+        self.assertEqual(warm.get_masks(), cold.get_masks())
+        self.assertEqual(pygame.image.tostring(warm, "RGBA"), pygame.image.tostring(cold, "RGBA"))
+        
+        #edits stay in memory
+        warm.fill((0,0,0,0))
+        self.assertEqual(tuple(self.loader.load(self.path).get_at((0,0))), (10,20,30,40))
+        
+    def test_invalidation(self):
+        self.loader.load(self.path)
+        self.img.fill((50,60,70,80))
+        pygame.image.save(self.img, self.path)
+        self.assertEqual(tuple(self.loader.load(self.path).get_at((0,0))), (50,60,70,80))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        
+        #unusable cache files are decoded around
+        for name in os.listdir(self.cache_dir):
+            open(os.path.join(self.cache_dir, name), "wb").close()
+        self.assertEqual(tuple(self.loader.load(self.path).get_at((0,0))), (50,60,70,80))
+        
+    def test_prune(self):
+        self.loader.load(self.path)
+        self.img.fill((50,60,70,80))
+        pygame.image.save(self.img, self.path)
+        open(os.path.join(self.cache_dir, "left.tmp"), "wb").close()
+        
+        #a later run only keeps the pixels of the current image
+        set_path = os.path.join(self.dir, "assets.txt")
+        f = open(set_path, "w")
+        f.write("image a a.png\n")
+        f.close()
+        manager = assetmanager.AssetManager(self.cache_dir)
+        manager.load_set(set_path, 1)
+        manager.prune_pixel_cache()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        self.assertEqual(tuple(manager.get("a").get_at((0,0))), (50,60,70,80))
+        
+    def test_unwritable(self):
+        loader = assetmanager.ImageLoader(os.path.join(self.path, "cache"))
+        self.assertEqual(tuple(loader.load(self.path).get_at((0,0))), (10,20,30,40))
+        
+        #a write failing part way leaves the image and no temporary file
+        class FullFile(object):
+            def __init__(self, fd):
+                os.close(fd)
+            def write(self, data):
+                raise IOError(28, "No space left on device")
+            def close(self):
+                pass
+        fdopen = os.fdopen
+        os.fdopen = lambda fd, mode: FullFile(fd)
+        try:
+            img = self.loader.load(self.path)
+        finally:
+            os.fdopen = fdopen
+        self.assertEqual(tuple(img.get_at((0,0))), (10,20,30,40))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        
+    def test_uncacheable(self):
+        img = pygame.Surface((4,3), 0, 8)
+        img.set_colorkey((0,0,0))
+        path = os.path.join(self.dir, "b.bmp")
+        pygame.image.save(img, path)
+        self.assertEqual(self.loader.load(path).get_size(), (4,3))
+        self.assertFalse(os.path.isdir(self.cache_dir) and os.listdir(self.cache_dir))
+        
 class DummyGameMgr(object):
     def __init__(self):
         self.director = self
@@ -89,6 +89,14 @@ class Viewport(object):
         else:
             return 1.0/(1-self._zoom)'''
         #return pow( 2, 0.5*self._zoom)
-        return pow( 2, self._zoom)
+        return self.scale_at( self._zoom)
         
     scale = property(get_scale)
+    
+    def scale_at(self, zoom):
+        """Returns the scale factor used at the given zoom level."""
+        return pow( 2, zoom)
+        
+    def zoom_scales(self):
+        """Returns the scale factors of every zoom level, smallest first."""
+        return [self.scale_at(z) for z in xrange(self.MINZOOM, self.MAXZOOM+1)]